@@ -0,0 +1,7 @@
+"""
+Analysis code shared by the example scripts.
+
+Everything in this package is compute-only: nothing here imports `matplotlib`, and
+`scipy` submodules are imported lazily inside the functions that need them, so the
+package is cheap to import from batch workers. Plotting lives in the example scripts.
+"""
@@ -0,0 +1,192 @@
+import numpy as np
+
+
+########################################################################################
+#
+# Constants.
+#
+########################################################################################
+
+# Microelectrode array locations, in the order used for array-level outputs.
+ARRAY_LABELS = ["v6v", "d6v", "4", "55b"]
+
+
+########################################################################################
+#
+# Electrode index.
+#
+########################################################################################
+
+
+class ElectrodeIndex:
+    """
+    Precomputed mapping from each microelectrode array to its electrodes, built once
+    from a block's `array_label_by_electrode`.
+
+    Electrodes are sorted by array, so array-level statistics are segmented reductions
+    (`np.add.reduceat`) over the electrode axis rather than per-electrode string
+    matching.
+    """
+
+    def __init__(self, array_label_by_electrode):
+        electrode_labels = np.char.strip(
+            np.asarray(array_label_by_electrode, dtype=str)
+        )
+        present_labels = set(electrode_labels.tolist())
+        self.array_labels = [label for label in ARRAY_LABELS if label in present_labels]
+        self.array_labels += sorted(present_labels - set(ARRAY_LABELS))
+        self.num_electrodes = len(electrode_labels)
+
+        label_order = {
+            label: array_idx for array_idx, label in enumerate(self.array_labels)
+        }
+        self.array_idx_by_electrode = np.array(
+            [label_order[label] for label in electrode_labels], dtype=np.int64
+        )
+
+        # Electrodes sorted by array (stable, so electrodes keep their order within an
+        # array), and where each array's segment starts in that order.
+        self.electrode_order = np.argsort(self.array_idx_by_electrode, kind="stable")
+        self.electrode_counts = np.bincount(
+            self.array_idx_by_electrode, minlength=len(self.array_labels)
+        )
+        self.segment_starts = np.concatenate(
+            [[0], np.cumsum(self.electrode_counts)[:-1]]
+        )
+
+        self.electrode_idxs = {
+            label: self.electrode_order[start : start + count]
+            for label, start, count in zip(
+                self.array_labels, self.segment_starts, self.electrode_counts
+            )
+        }
+        # Slices for arrays whose electrodes are contiguous (as in the Dryad files),
+        # which index without copying.
+        self.electrode_slices = {}
+        for label, electrode_idxs in self.electrode_idxs.items():
+            if np.all(np.diff(electrode_idxs) == 1):
+                self.electrode_slices[label] = slice(
+                    int(electrode_idxs[0]), int(electrode_idxs[-1]) + 1
+                )
+
+    @classmethod
+    def from_block(cls, block_data):
+        return cls(block_data["array_label_by_electrode"])
+
+    def get_array_label(self, electrode_idx):
+        return self.array_labels[self.array_idx_by_electrode[electrode_idx]]
+
+    def select(self, values, array_label, axis=-1):
+        """
+        Get the values of one array's electrodes along `axis`, as a view when the
+        array's electrodes are contiguous.
+        """
+        values = np.asarray(values)
+        electrode_slice = self.electrode_slices.get(array_label)
+        if electrode_slice is None:
+            return np.take(values, self.electrode_idxs[array_label], axis=axis)
+
+        return values[(slice(None),) * (axis % values.ndim) + (electrode_slice,)]
+
+    def sum(self, values, axis=-1):
+        """
+        Sum `values` over the electrodes of each array along `axis`. The output has the
+        electrode axis replaced by an array axis, in `array_labels` order.
+        """
+        values = np.asarray(values)
+        sorted_values = np.take(values, self.electrode_order, axis=axis)
+
+        return np.add.reduceat(sorted_values, self.segment_starts, axis=axis)
+
+    def mean(self, values, axis=-1):
+        """
+        Average `values` over the electrodes of each array along `axis`.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        shape = [1] * values.ndim
+        shape[axis] = len(self.array_labels)
+
+        return self.sum(values, axis=axis) / self.electrode_counts.reshape(shape)
+
+    def nanmean(self, values, axis=-1):
+        """
+        Like `mean`, but ignoring NaN values.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        is_finite = np.isfinite(values)
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return self.sum(np.where(is_finite, values, 0.0), axis=axis) / self.sum(
+                is_finite, axis=axis
+            )
+
+
+########################################################################################
+#
+# Array-level aggregates.
+#
+########################################################################################
+
+
+def get_array_population_rates(firing_rates, electrode_index):
+    """
+    Average firing rate across each array's electrodes at each bin. Returns bins x
+    arrays, in `electrode_index.array_labels` order.
+    """
+    return electrode_index.mean(firing_rates, axis=-1)
+
+
+def get_array_condition_modulation(trial_averaged_by_condition, electrode_index):
+    """
+    How strongly each array's electrodes are modulated by condition (e.g., direction or
+    prompt): for each electrode, the range across conditions of its window-averaged
+    firing rate, averaged over each array's electrodes. Conditions with no trials are
+    skipped. Returns a dict of array label to modulation (Hz).
+    """
+    condition_rates = np.array(
+        [
+            np.mean(trial_averaged, axis=0)
+            for trial_averaged in trial_averaged_by_condition.values()
+            if np.all(np.isfinite(trial_averaged))
+        ]
+    )
+    modulation = condition_rates.max(axis=0) - condition_rates.min(axis=0)
+
+    return dict(zip(electrode_index.array_labels, electrode_index.mean(modulation)))
+
+
+def get_array_tuning_summary(tuning, electrode_index):
+    """
+    Average the per-electrode metrics of a `tuning.fit_cosine_tuning` result over each
+    array's electrodes. The preferred direction is summarized by its resultant length
+    (1 when all of an array's electrodes prefer the same direction). Returns a dict of
+    array label to dict of metric.
+    """
+    direction_vectors = np.array(
+        [np.cos(tuning["preferred_direction"]), np.sin(tuning["preferred_direction"])]
+    )
+    summaries = {
+        "baseline": electrode_index.nanmean(tuning["baseline"]),
+        "modulation_depth": electrode_index.nanmean(tuning["modulation_depth"]),
+        "r_squared": electrode_index.nanmean(tuning["r_squared"]),
+        "preferred_direction_resultant_length": np.hypot(
+            *electrode_index.nanmean(direction_vectors, axis=1)
+        ),
+    }
+
+    return {
+        array_label: {name: summary[array_idx] for name, summary in summaries.items()}
+        for array_idx, array_label in enumerate(electrode_index.array_labels)
+    }
+
+
+def get_array_decoding_summary(decoding_by_array):
+    """
+    Collect accuracy and chance accuracy from the per-array results of
+    `decoding.decode_speech_prompts`. Returns a dict of array label to
+    `(accuracy, chance_accuracy)`.
+    """
+    return {
+        array_label: (result["accuracy"], result["chance_accuracy"])
+        for array_label, result in decoding_by_array.items()
+    }
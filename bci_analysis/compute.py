@@ -0,0 +1,636 @@
+import os
+import re
+
+import numpy as np
+
+
+########################################################################################
+#
+# Constants.
+#
+########################################################################################
+
+BIN_WIDTH_sec = 0.01
+
+PRE_GO_CUE_sec = 0.5
+POST_GO_CUE_sec = 1.0
+PRE_GO_CUE_bins = int(PRE_GO_CUE_sec / BIN_WIDTH_sec)
+POST_GO_CUE_bins = int(POST_GO_CUE_sec / BIN_WIDTH_sec)
+
+SMOOTHING_SIGMA = 5
+
+CENTER_TARGET = np.array([0.0, 0.0])
+
+PROMPTS = ["bah", "though", "day", "kite", "choice", "veto", "were"]
+
+# The Grid Evaluation Task used a 14x14 grid of targets.
+GRID_TOTAL_TARGET_OPTIONS = 14 * 14
+
+# Radial8 Calibration Task blocks from the First-ever Usage Session.
+FIRST_EVER_USAGE_FILEPATHS = [
+    "./dryad_files/t15_day00039_block00_radial8_calibration_task.mat",
+    "./dryad_files/t15_day00039_block01_radial8_calibration_task.mat",
+    "./dryad_files/t15_day00039_block02_radial8_calibration_task.mat",
+    "./dryad_files/t15_day00039_block03_radial8_calibration_task.mat",
+    "./dryad_files/t15_day00039_block04_radial8_calibration_task.mat",
+    "./dryad_files/t15_day00039_block05_radial8_calibration_task.mat",
+]
+
+# Grid Evaluation Task blocks from the last Evaluation Session. This session used the
+# improved decoder and denser grid.
+GRID_EVALUATION_FILEPATHS = [
+    "./dryad_files/t15_day00468_block03_grid_evaluation_task.mat",
+    "./dryad_files/t15_day00468_block04_grid_evaluation_task.mat",
+    "./dryad_files/t15_day00468_block05_grid_evaluation_task.mat",
+    "./dryad_files/t15_day00468_block09_grid_evaluation_task.mat",
+    "./dryad_files/t15_day00468_block10_grid_evaluation_task.mat",
+    "./dryad_files/t15_day00468_block11_grid_evaluation_task.mat",
+    "./dryad_files/t15_day00468_block15_grid_evaluation_task.mat",
+    "./dryad_files/t15_day00468_block16_grid_evaluation_task.mat",
+    "./dryad_files/t15_day00468_block17_grid_evaluation_task.mat",
+]
+
+# Simultaneous Speech and Cursor Task blocks from the Simultaneous Speech and Cursor
+# Session.
+SIMULTANEOUS_SPEECH_AND_CURSOR_FILEPATHS = [
+    "./dryad_files/t15_day00202_block02_simultaneous_speech_and_cursor_task.mat",
+    "./dryad_files/t15_day00202_block03_simultaneous_speech_and_cursor_task.mat",
+    "./dryad_files/t15_day00202_block04_simultaneous_speech_and_cursor_task.mat",
+    "./dryad_files/t15_day00202_block05_simultaneous_speech_and_cursor_task.mat",
+    "./dryad_files/t15_day00202_block06_simultaneous_speech_and_cursor_task.mat",
+    "./dryad_files/t15_day00202_block07_simultaneous_speech_and_cursor_task.mat",
+    "./dryad_files/t15_day00202_block10_simultaneous_speech_and_cursor_task.mat",
+    "./dryad_files/t15_day00202_block11_simultaneous_speech_and_cursor_task.mat",
+    "./dryad_files/t15_day00202_block12_simultaneous_speech_and_cursor_task.mat",
+    "./dryad_files/t15_day00202_block13_simultaneous_speech_and_cursor_task.mat",
+    "./dryad_files/t15_day00202_block14_simultaneous_speech_and_cursor_task.mat",
+    "./dryad_files/t15_day00202_block15_simultaneous_speech_and_cursor_task.mat",
+    "./dryad_files/t15_day00202_block16_simultaneous_speech_and_cursor_task.mat",
+    "./dryad_files/t15_day00202_block17_simultaneous_speech_and_cursor_task.mat",
+    "./dryad_files/t15_day00202_block18_simultaneous_speech_and_cursor_task.mat",
+    "./dryad_files/t15_day00202_block21_simultaneous_speech_and_cursor_task.mat",
+    "./dryad_files/t15_day00202_block22_simultaneous_speech_and_cursor_task.mat",
+    "./dryad_files/t15_day00202_block23_simultaneous_speech_and_cursor_task.mat",
+    "./dryad_files/t15_day00202_block24_simultaneous_speech_and_cursor_task.mat",
+    "./dryad_files/t15_day00202_block25_simultaneous_speech_and_cursor_task.mat",
+    "./dryad_files/t15_day00202_block26_simultaneous_speech_and_cursor_task.mat",
+]
+
+
+########################################################################################
+#
+# Loading.
+#
+########################################################################################
+
+
+def load_block(filepath):
+    """
+    Load one `.mat` block file into a dict of arrays.
+    """
+    import scipy.io
+
+    return scipy.io.loadmat(filepath)
+
+
+def load_blocks(filepaths):
+    """
+    Load a list of `.mat` block files. Raises FileNotFoundError if any are missing.
+    """
+    return [load_block(filepath) for filepath in filepaths]
+
+
+def save_npz(filepath, arrays):
+    """
+    Save a dict of arrays to an `.npz` file, creating its directory if needed. The
+    arrays are written to a temporary file first, so an interrupted run never leaves a
+    truncated file behind.
+    """
+    os.makedirs(os.path.dirname(filepath) or ".", exist_ok=True)
+    temporary_filepath = f"{filepath}.tmp.npz"
+    np.savez(temporary_filepath, **arrays)
+    os.replace(temporary_filepath, filepath)
+
+
+def get_block_id(filepath):
+    """
+    Get the `(day, block)` numbers of a block file from its name, e.g. `(39, 0)` for
+    `t15_day00039_block00_radial8_calibration_task.mat`.
+    """
+    match = re.search(r"day(\d+)_block(\d+)", os.path.basename(filepath))
+    if match is None:
+        raise ValueError(f"Not a block filename: {filepath!r}")
+
+    return int(match.group(1)), int(match.group(2))
+
+
+def get_ABA_blocks(data):
+    """
+    The 21 simul blocks (A = verbal, B = control) were collected in 3 sets as follows:
+    1. A A B A A B
+    2. A A B A A B A A B
+    3. A A B A A B
+    with a break and some cursor calibration before each set.
+
+    To allow for a fair comparison between verbal and control blocks, we should have an
+    A B A structure from each set. Achieve this by excluding the first A in each set and
+    the last A B in each set.
+    """
+    return list(data[1:4]) + list(data[7:13]) + list(data[16:19])
+
+
+########################################################################################
+#
+# Helpers.
+#
+########################################################################################
+
+
+def get_direction_idx_from_vector(vector):
+    """
+    Given a 2D vector, get an integer from 0 through 7 corresponding to the 1/8th slice
+    of the unit circle it falls in. Good for identifying a radial8 target, or a position
+    near a radial8 target.
+    """
+    x, y = vector
+
+    target_angle = np.arctan2(y, x)
+    if target_angle < 0:
+        target_angle += 2 * np.pi
+
+    direction_idx = int(np.round(target_angle / (np.pi / 4))) % 8
+
+    return direction_idx
+
+
+def get_direction_idxs_from_vectors(vectors):
+    """
+    Vectorized version of `get_direction_idx_from_vector` for an array of 2D vectors of
+    shape (N, 2). Returns an integer array of shape (N,).
+    """
+    vectors = np.asarray(vectors, dtype=np.float64).reshape(-1, 2)
+
+    target_angles = np.arctan2(vectors[:, 1], vectors[:, 0])
+    target_angles = np.where(
+        target_angles < 0, target_angles + 2 * np.pi, target_angles
+    )
+
+    direction_idxs = np.round(target_angles / (np.pi / 4)).astype(np.int64) % 8
+
+    return direction_idxs
+
+
+def get_firing_rates(threshold_crossings, smoothing_sigma=SMOOTHING_SIGMA):
+    """
+    Scale threshold crossings values to represent firing rates in Hz, then apply
+    Gaussian smoothing over time.
+    """
+    from scipy.ndimage import gaussian_filter1d
+
+    firing_rates = threshold_crossings / BIN_WIDTH_sec
+    firing_rates = gaussian_filter1d(firing_rates, sigma=smoothing_sigma, axis=0)
+
+    return firing_rates
+
+
+def get_array_label(block_data, electrode_idx):
+    """
+    Get the array label (one of `v6v`, `d6v`, `4`, or `55b`) of an electrode.
+    """
+    return block_data["array_label_by_electrode"][electrode_idx].strip()
+
+
+def get_relative_timestamps():
+    """
+    Timestamps (in seconds) of each bin in an aligned window, relative to the event the
+    window is aligned to.
+    """
+    num_bins_in_window = int((PRE_GO_CUE_sec + POST_GO_CUE_sec) / BIN_WIDTH_sec)
+    relative_timestamps = np.linspace(
+        -PRE_GO_CUE_sec, POST_GO_CUE_sec, num_bins_in_window
+    )
+
+    return relative_timestamps
+
+
+def get_trial_table(block_data):
+    """
+    Collect the per-trial fields of a block into a dict of arrays, one entry per trial.
+
+    Always contains `trial_start_bin`, `target_position` (the cued target at the start
+    of the trial), `direction_idx` and `is_toward_center_target`. Simultaneous Speech
+    and Cursor Task blocks additionally contain `target_presentation_bin`,
+    `cursor_go_cue_bin`, `speech_go_cue_bin`, `trial_end_bin`, `speech_prompt`,
+    `is_beep_trial` and `is_control_block`.
+    """
+    target_positions = block_data["target_position"]
+    trial_start_bins = block_data["trial_start_bin"].flatten()
+
+    trial_table = {"trial_start_bin": trial_start_bins}
+
+    if "target_presentation_bin" in block_data:
+        target_presentation_bins = block_data["target_presentation_bin"].flatten()
+        speech_go_cue_bins = block_data["speech_go_cue_bin"].flatten()
+        num_trials = len(target_presentation_bins)
+
+        trial_table["target_presentation_bin"] = target_presentation_bins
+        trial_table["cursor_go_cue_bin"] = block_data["cursor_go_cue_bin"].flatten()
+        trial_table["speech_go_cue_bin"] = speech_go_cue_bins
+        trial_table["trial_end_bin"] = block_data["trial_end_bin"].flatten()
+        trial_table["speech_prompt"] = np.array(
+            [s.item() for s in block_data["speech_prompt"].flatten()]
+        )
+        # If there was no beep in a trial, the speech go cue bin is -1.
+        trial_table["is_beep_trial"] = speech_go_cue_bins != -1
+        trial_table["is_control_block"] = np.full(
+            num_trials, bool(block_data["is_control_block"].item())
+        )
+        trial_cue_bins = target_presentation_bins
+    else:
+        trial_cue_bins = trial_start_bins
+
+    trial_targets = target_positions[trial_cue_bins]
+    trial_table["target_position"] = trial_targets
+    trial_table["direction_idx"] = get_direction_idxs_from_vectors(trial_targets)
+    trial_table["is_toward_center_target"] = np.all(
+        trial_targets == CENTER_TARGET, axis=1
+    )
+
+    return trial_table
+
+
+def merge_grouped(grouped_list):
+    """
+    Merge a list of dicts of lists or arrays (e.g., neural windows grouped by direction,
+    one dict per block) into a single dict of lists, keeping the key order of the first
+    dict.
+    """
+    merged = {}
+    for grouped in grouped_list:
+        for key, values in grouped.items():
+            merged.setdefault(key, []).extend(values)
+
+    return merged
+
+
+def get_trial_averages(neural_windows_grouped):
+    """
+    Given a dict of lists of neural windows (each of shape bins x electrodes), average
+    across trials for each key. Returns the trial averages and the standard errors of
+    the mean, as two dicts with the same keys.
+    """
+    trial_averaged = {
+        key: np.mean(neural_windows, axis=0)
+        for key, neural_windows in neural_windows_grouped.items()
+    }
+    sem = {
+        key: np.std(neural_windows, axis=0) / np.sqrt(len(neural_windows))
+        for key, neural_windows in neural_windows_grouped.items()
+    }
+
+    return trial_averaged, sem
+
+
+########################################################################################
+#
+# Alignment.
+#
+########################################################################################
+
+
+def align_to_events(
+    signals,
+    event_bins_by_name,
+    masks_by_name=None,
+    pre_bins=PRE_GO_CUE_bins,
+    post_bins=POST_GO_CUE_bins,
+):
+    """
+    Cut windows of `signals` (bins x channels) around several kinds of events at once.
+
+    `event_bins_by_name` maps an event name (e.g., `"cursor_go_cue"`) to an array of
+    per-trial event bins, and `masks_by_name` optionally maps the same names to boolean
+    per-trial masks of which trials to keep. Trials whose event bin is `-1` (e.g., no
+    beep) or whose window would go outside the block are always dropped.
+
+    All windows of all events are gathered from `signals` with a single fancy-indexing
+    operation. Returns two dicts keyed by event name: the aligned windows, of shape
+    (trials x bins x channels), and the indices of the trials they came from.
+    """
+    if masks_by_name is None:
+        masks_by_name = {}
+
+    total_bins = len(signals)
+    window_offsets = np.arange(-pre_bins, post_bins)
+
+    kept_trial_idxs_by_name = {}
+    for name, event_bins in event_bins_by_name.items():
+        event_bins = np.asarray(event_bins).ravel()
+        is_kept = (
+            (event_bins != -1)
+            & (event_bins - pre_bins >= 0)
+            & (event_bins + post_bins <= total_bins)
+        )
+        if name in masks_by_name:
+            is_kept &= np.asarray(masks_by_name[name], dtype=bool).ravel()
+        kept_trial_idxs_by_name[name] = np.flatnonzero(is_kept)
+
+    # One gather over the block for every window of every event.
+    all_event_bins = np.concatenate(
+        [
+            np.asarray(event_bins_by_name[name]).ravel()[kept_trial_idxs]
+            for name, kept_trial_idxs in kept_trial_idxs_by_name.items()
+        ]
+        + [np.zeros(0, dtype=np.int64)]
+    ).astype(np.int64)
+    all_windows = signals[all_event_bins[:, np.newaxis] + window_offsets]
+
+    split_idxs = np.cumsum(
+        [len(kept_trial_idxs) for kept_trial_idxs in kept_trial_idxs_by_name.values()]
+    )[:-1]
+    aligned_by_name = dict(
+        zip(kept_trial_idxs_by_name, np.split(all_windows, split_idxs, axis=0))
+    )
+
+    return aligned_by_name, kept_trial_idxs_by_name
+
+
+def group_windows(windows, labels, keys):
+    """
+    Group aligned windows (trials x bins x channels) by a per-trial label. Returns a
+    dict mapping each key to the windows of the trials with that label.
+    """
+    labels = np.asarray(labels)
+
+    return {key: windows[labels == key] for key in keys}
+
+
+########################################################################################
+#
+# Figure 1: First-ever cursor BCI usage.
+#
+########################################################################################
+
+
+def get_center_out_and_back_trajectories(block_data):
+    """
+    Get the cursor trajectories of the fully closed-loop center-out-and-back movements
+    in a Radial8 Calibration Task block. Returns a list of
+    `(direction_idx, trial_target, trajectory)` tuples.
+    """
+    cursor_positions = block_data["cursor_position"]
+    target_positions = block_data["target_position"]
+    assist_amounts = block_data["assist_amount"].flatten()
+    trial_start_bins = block_data["trial_start_bin"].flatten()
+
+    trajectories = []
+
+    for trial_idx, trial_start_bin in enumerate(trial_start_bins):
+        # If this trial used any assist, skip it. Only keep fully closed-loop trials.
+        starting_assist_amount = assist_amounts[trial_start_bin]
+        if starting_assist_amount > 0.0:
+            continue
+
+        # Each trajectory will start with a movement toward an outer target.
+        trial_target = target_positions[trial_start_bin]
+        is_toward_center_target = np.all(trial_target == CENTER_TARGET)
+        if is_toward_center_target:
+            continue
+
+        # If the block ends during this center-out-and-back, skip it.
+        if trial_idx + 2 >= len(trial_start_bins):
+            continue
+
+        # Get the range of bins representing the full center-out-and-back, which
+        # includes the center-out trial plus the following trial back to center.
+        trajectory_start_bin = trial_start_bin
+        trajectory_end_bin = trial_start_bins[trial_idx + 2]
+
+        trajectory = cursor_positions[trajectory_start_bin:trajectory_end_bin]
+
+        direction_idx = get_direction_idx_from_vector(trial_target)
+        trajectories.append((direction_idx, trial_target, trajectory))
+
+    return trajectories
+
+
+def get_radial8_block_windows(trial_table, firing_rates):
+    """
+    Get windows of smoothed firing rates aligned to the start of each outer-target trial
+    in one Radial8 Calibration Task block, grouped by target direction.
+    """
+    # Skip trials toward the center target (the user can anticipate the target).
+    # Windows at the start or end of the block which go outside the block are skipped
+    # by `align_to_events`.
+    aligned_by_event, trial_idxs_by_event = align_to_events(
+        firing_rates,
+        {"trial_start": trial_table["trial_start_bin"]},
+        {"trial_start": ~trial_table["is_toward_center_target"]},
+    )
+
+    trial_idxs = trial_idxs_by_event["trial_start"]
+
+    return group_windows(
+        aligned_by_event["trial_start"],
+        trial_table["direction_idx"][trial_idxs],
+        range(8),
+    )
+
+
+def get_radial8_windows_by_direction(data):
+    """
+    Get windows of smoothed firing rates aligned to the start of each outer-target trial
+    in Radial8 Calibration Task blocks, grouped by target direction.
+    """
+    return merge_grouped(
+        [
+            get_radial8_block_windows(
+                get_trial_table(block_data),
+                get_firing_rates(block_data["threshold_crossings"]),
+            )
+            for block_data in data
+        ]
+    )
+
+
+########################################################################################
+#
+# Figure 2: Cursor BCI grid evaluation.
+#
+########################################################################################
+
+
+def get_grid_block_results(block_data):
+    """
+    Get the trial results of a Grid Evaluation Task block. Returns a dict with the
+    timestamps of the trial-ending clicks, whether each click was on the cued target,
+    the trial lengths, and the block's bitrate (in bits per second).
+    """
+    timestamps = block_data["timestamp_sec"].flatten()
+    cursor_positions = block_data["cursor_position"]
+    target_positions = block_data["target_position"]
+    trial_start_bins = block_data["trial_start_bin"].flatten()
+    grid_num_rows = block_data["grid_num_rows"].item()
+    grid_total_height = block_data["grid_total_height"].item()
+
+    # Get which bins the cursor was on the cued target.
+    row_height = column_width = grid_total_height / grid_num_rows
+    target_distances = np.abs(target_positions - cursor_positions)
+    is_within_x = target_distances[:, 0] < (column_width / 2)
+    is_within_y = target_distances[:, 1] < (row_height / 2)
+    is_on_cued_target = is_within_x & is_within_y
+
+    # Get which trial-ending clicks were on the cued target and which were not.
+    trial_ending_click_bins = trial_start_bins[1:] - 1
+    trial_ending_click_timestamps = timestamps[trial_ending_click_bins]
+    trial_results = is_on_cued_target[trial_ending_click_bins]
+
+    # Get trial lengths.
+    trial_start_timestamps = timestamps[trial_start_bins]
+    trial_lengths = np.diff(trial_start_timestamps)
+
+    # Calculate bitrate.
+    total_length = timestamps[-1] - timestamps[0]
+    num_success = np.sum(trial_results)
+    num_fail = len(trial_results) - num_success
+    net_target_selections = num_success - num_fail
+    bits_per_selection = np.log2(GRID_TOTAL_TARGET_OPTIONS - 1)
+    bitrate = (net_target_selections * bits_per_selection) / total_length
+
+    return {
+        "trial_ending_click_timestamps": trial_ending_click_timestamps,
+        "trial_results": trial_results,
+        "trial_lengths": trial_lengths,
+        "bitrate": bitrate,
+    }
+
+
+########################################################################################
+#
+# Figure 4: Simultaneous speech and cursor.
+#
+########################################################################################
+
+
+def get_block_acquisition_times(block_data):
+    """
+    Calculate target acquisition times in one Simultaneous Speech and Cursor Task block
+    and group them by task condition. Returns a dict with the keys `control_nobeep`,
+    `control_beep`, `verbal_nobeep` and `verbal_beep`.
+    """
+    acquisition_times_by_condition = {
+        "control_nobeep": [],
+        "control_beep": [],
+        "verbal_nobeep": [],
+        "verbal_beep": [],
+    }
+
+    timestamps = block_data["timestamp_sec"].flatten()
+    cursor_go_cue_bins = block_data["cursor_go_cue_bin"].flatten()
+    speech_go_cue_bins = block_data["speech_go_cue_bin"].flatten()
+    trial_end_bins = block_data["trial_end_bin"].flatten()
+    is_control_block = block_data["is_control_block"].item()
+
+    for trial_idx in range(len(cursor_go_cue_bins)):
+        cursor_go_cue_bin = cursor_go_cue_bins[trial_idx]
+        speech_go_cue_bin = speech_go_cue_bins[trial_idx]
+        trial_end_bin = trial_end_bins[trial_idx]
+
+        # If there was no beep in this trial, the speech go cue bin is -1.
+        is_beep_trial = speech_go_cue_bin != -1
+
+        trial_end_timestamp = timestamps[trial_end_bin]
+        cursor_go_cue_timestamp = timestamps[cursor_go_cue_bin]
+        target_acquisition_time = trial_end_timestamp - cursor_go_cue_timestamp
+
+        block_type = "control" if is_control_block else "verbal"
+        trial_type = "beep" if is_beep_trial else "nobeep"
+        acquisition_times_by_condition[f"{block_type}_{trial_type}"].append(
+            target_acquisition_time
+        )
+
+    return acquisition_times_by_condition
+
+
+def get_acquisition_times_by_condition(data):
+    """
+    Calculate target acquisition times in Simultaneous Speech and Cursor Task blocks and
+    group them by task condition. Returns a dict with the keys `control_nobeep`,
+    `control_beep`, `verbal_nobeep` and `verbal_beep`.
+    """
+    return merge_grouped(
+        [get_block_acquisition_times(block_data) for block_data in data]
+    )
+
+
+def get_simultaneous_block_windows(trial_table, firing_rates):
+    """
+    Get windows of smoothed firing rates in one Simultaneous Speech and Cursor Task
+    block, aligned to different stages of the trial. Returns three dicts of windows:
+    aligned to target presentation (by direction), aligned to cursor go cue (by
+    direction), and aligned to speech go cue (by prompt).
+    """
+    # Target presentation and cursor go cue: skip trials with a beep, and trials toward
+    # the center target (the user can anticipate the target).
+    is_nobeep_outer_target_trial = (
+        ~trial_table["is_beep_trial"] & ~trial_table["is_toward_center_target"]
+    )
+    # Speech go cue: skip trials with no beep, and trials in control blocks (since
+    # control blocks don't have speech).
+    is_verbal_beep_trial = (
+        trial_table["is_beep_trial"] & ~trial_table["is_control_block"]
+    )
+
+    aligned_by_event, trial_idxs_by_event = align_to_events(
+        firing_rates,
+        {
+            "target_presentation": trial_table["target_presentation_bin"],
+            "cursor_go_cue": trial_table["cursor_go_cue_bin"],
+            "speech_go_cue": trial_table["speech_go_cue_bin"],
+        },
+        {
+            "target_presentation": is_nobeep_outer_target_trial,
+            "cursor_go_cue": is_nobeep_outer_target_trial,
+            "speech_go_cue": is_verbal_beep_trial,
+        },
+    )
+
+    presentation_windows_grouped_by_direction = group_windows(
+        aligned_by_event["target_presentation"],
+        trial_table["direction_idx"][trial_idxs_by_event["target_presentation"]],
+        range(8),
+    )
+    cursor_go_cue_windows_grouped_by_direction = group_windows(
+        aligned_by_event["cursor_go_cue"],
+        trial_table["direction_idx"][trial_idxs_by_event["cursor_go_cue"]],
+        range(8),
+    )
+    speech_go_cue_windows_grouped_by_prompt = group_windows(
+        aligned_by_event["speech_go_cue"],
+        trial_table["speech_prompt"][trial_idxs_by_event["speech_go_cue"]],
+        PROMPTS,
+    )
+
+    return (
+        presentation_windows_grouped_by_direction,
+        cursor_go_cue_windows_grouped_by_direction,
+        speech_go_cue_windows_grouped_by_prompt,
+    )
+
+
+def get_simultaneous_windows(data):
+    """
+    Get windows of smoothed firing rates in Simultaneous Speech and Cursor Task blocks,
+    aligned to different stages of the trial. Returns three dicts of lists of windows:
+    aligned to target presentation (by direction), aligned to cursor go cue (by
+    direction), and aligned to speech go cue (by prompt).
+    """
+    block_windows = [
+        get_simultaneous_block_windows(
+            get_trial_table(block_data),
+            get_firing_rates(block_data["threshold_crossings"]),
+        )
+        for block_data in data
+    ]
+
+    return tuple(merge_grouped(grouped_list) for grouped_list in zip(*block_windows))
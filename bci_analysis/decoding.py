@@ -0,0 +1,435 @@
+import numpy as np
+
+from bci_analysis import compute
+from bci_analysis.arrays import ElectrodeIndex
+
+
+########################################################################################
+#
+# Constants.
+#
+########################################################################################
+
+NUM_FOLDS = 5
+
+# Window (relative to the aligned event) over which firing rates are averaged to get
+# each trial's features.
+DECODING_WINDOW_START_sec = 0.0
+DECODING_WINDOW_END_sec = 1.0
+
+LOGISTIC_REGRESSION_L2_PENALTY = 1.0
+LOGISTIC_REGRESSION_NUM_ITERATIONS = 300
+
+
+########################################################################################
+#
+# Features and folds.
+#
+########################################################################################
+
+
+def get_window_features(
+    windows,
+    start_sec=DECODING_WINDOW_START_sec,
+    end_sec=DECODING_WINDOW_END_sec,
+):
+    """
+    Average aligned windows (trials x bins x electrodes, aligned as in
+    `compute.align_to_events`) over `start_sec` to `end_sec` relative to the event.
+    Returns trials x electrodes.
+    """
+    start_bin = compute.PRE_GO_CUE_bins + int(round(start_sec / compute.BIN_WIDTH_sec))
+    end_bin = compute.PRE_GO_CUE_bins + int(round(end_sec / compute.BIN_WIDTH_sec))
+
+    return np.asarray(windows)[:, start_bin:end_bin].mean(axis=1)
+
+
+def get_labeled_trials(windows_grouped):
+    """
+    Flatten windows grouped by label (e.g., `speech_go_cue_windows_grouped_by_prompt`)
+    into one array of windows (trials x bins x electrodes) and an array of labels.
+    """
+    windows = np.concatenate(
+        [
+            np.asarray(label_windows).reshape(-1, *np.shape(label_windows)[-2:])
+            for label_windows in windows_grouped.values()
+            if len(label_windows)
+        ]
+    )
+    labels = np.concatenate(
+        [
+            np.full(len(label_windows), label, dtype=object)
+            for label, label_windows in windows_grouped.items()
+            if len(label_windows)
+        ]
+    )
+
+    return windows, labels
+
+
+def get_stratified_folds(label_idxs, num_folds=NUM_FOLDS, seed=0):
+    """
+    Assign each trial to one of `num_folds` folds, shuffled and balanced within each
+    class. Returns the fold index of each trial.
+    """
+    rng = np.random.default_rng(seed)
+    fold_idxs = np.empty(len(label_idxs), dtype=np.int64)
+    for label_idx in np.unique(label_idxs):
+        trial_idxs = rng.permutation(np.flatnonzero(label_idxs == label_idx))
+        fold_idxs[trial_idxs] = np.arange(len(trial_idxs)) % num_folds
+
+    return fold_idxs
+
+
+########################################################################################
+#
+# Batched classifiers.
+#
+# Both classifiers take features with a leading batch axis (batch x trials x features)
+# and fit one model per (batch, fold) pair together as stacked linear algebra. They
+# return the held-out predicted class index of every trial, of shape (batch x trials).
+#
+########################################################################################
+
+
+def _get_fold_class_weights(label_idxs, fold_idxs, num_classes, num_folds):
+    # (folds x trials) of which trials each fold trains on, and (folds x trials x
+    # classes) of which training trials belong to each class.
+    is_train = fold_idxs != np.arange(num_folds)[:, np.newaxis]
+    class_one_hot = label_idxs[:, np.newaxis] == np.arange(num_classes)
+    train_class = is_train[:, :, np.newaxis] & class_one_hot
+
+    return is_train.astype(np.float64), train_class.astype(np.float64)
+
+
+def _select_held_out(scores, fold_idxs):
+    # scores: (batch x folds x trials x classes). Keep each trial's scores from the
+    # model that did not train on it.
+    held_out_scores = scores[:, fold_idxs, np.arange(len(fold_idxs))]
+
+    return np.argmax(held_out_scores, axis=-1)
+
+
+def predict_lda(features, label_idxs, fold_idxs, num_classes, shrinkage="auto"):
+    """
+    Cross-validated shrinkage linear discriminant analysis.
+
+    The pooled within-class covariance of each fold's training trials is shrunk toward
+    a scaled identity, either by the fixed fraction `shrinkage` or, with `"auto"`, by
+    the Ledoit-Wolf estimate for that fold. All folds (and batch entries) are fit with
+    one batched solve.
+    """
+    features = np.asarray(features, dtype=np.float64)
+    num_features = features.shape[-1]
+    num_folds = int(fold_idxs.max()) + 1
+    is_train, train_class = _get_fold_class_weights(
+        label_idxs, fold_idxs, num_classes, num_folds
+    )
+
+    class_counts = train_class.sum(axis=1)
+    num_train = is_train.sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        class_means = (
+            np.swapaxes(train_class, -1, -2)
+            @ features[:, np.newaxis]
+            / (class_counts[np.newaxis, :, :, np.newaxis])
+        )
+    class_means = np.nan_to_num(class_means)
+
+    # Pooled within-class scatter of the training trials of each fold.
+    train_features = is_train[np.newaxis, :, :, np.newaxis] * features[:, np.newaxis]
+    scatter = np.swapaxes(train_features, -1, -2) @ features[:, np.newaxis] - (
+        np.swapaxes(class_means, -1, -2) @ (class_counts[..., np.newaxis] * class_means)
+    )
+    covariance = scatter / num_train[np.newaxis, :, np.newaxis, np.newaxis]
+
+    mean_variance = np.trace(covariance, axis1=-2, axis2=-1) / num_features
+    identity = np.eye(num_features)
+    if shrinkage == "auto":
+        # Ledoit-Wolf shrinkage toward mean_variance * I, from the class-centered
+        # training trials.
+        centered = features[:, np.newaxis] - class_means[:, :, label_idxs]
+        squared_norms = np.sum(centered**2, axis=-1)
+        quadratic_forms = np.sum((centered @ covariance) * centered, axis=-1)
+        covariance_norm = np.sum(covariance**2, axis=(-2, -1))
+        sample_deviations = (
+            squared_norms**2 - 2 * quadratic_forms + covariance_norm[..., np.newaxis]
+        )
+        b_squared = (
+            np.einsum("kn,bkn->bk", is_train, sample_deviations) / num_train**2
+        )
+        d_squared = np.sum(
+            (covariance - mean_variance[..., np.newaxis, np.newaxis] * identity) ** 2,
+            axis=(-2, -1),
+        )
+        with np.errstate(divide="ignore", invalid="ignore"):
+            shrinkage = np.clip(np.minimum(b_squared, d_squared) / d_squared, 0, 1)
+        shrinkage = np.nan_to_num(shrinkage, nan=1.0)
+    shrinkage = np.broadcast_to(shrinkage, mean_variance.shape)[..., None, None]
+
+    shrunk_covariance = (1 - shrinkage) * covariance + shrinkage * (
+        mean_variance[..., np.newaxis, np.newaxis] * identity
+    )
+    # Guard against an all-zero covariance (e.g., silent electrodes only).
+    shrunk_covariance = shrunk_covariance + 1e-9 * identity
+
+    coefficients = np.linalg.solve(shrunk_covariance, np.swapaxes(class_means, -1, -2))
+    with np.errstate(divide="ignore"):
+        log_priors = np.log(class_counts / num_train[:, np.newaxis])
+    intercepts = (
+        -0.5 * np.einsum("bkcp,bkpc->bkc", class_means, coefficients) + log_priors
+    )
+
+    scores = features[:, np.newaxis] @ coefficients + intercepts[:, :, np.newaxis, :]
+
+    return _select_held_out(scores, fold_idxs)
+
+
+def predict_logistic_regression(
+    features,
+    label_idxs,
+    fold_idxs,
+    num_classes,
+    l2_penalty=LOGISTIC_REGRESSION_L2_PENALTY,
+    num_iterations=LOGISTIC_REGRESSION_NUM_ITERATIONS,
+):
+    """
+    Cross-validated L2-regularized multinomial logistic regression.
+
+    Features are z-scored with each fold's training statistics, and every (batch, fold)
+    model is trained together by accelerated full-batch gradient descent on stacked
+    weight tensors.
+    """
+    features = np.asarray(features, dtype=np.float64)
+    num_batch, num_trials, num_features = features.shape
+    num_folds = int(fold_idxs.max()) + 1
+    is_train, train_class = _get_fold_class_weights(
+        label_idxs, fold_idxs, num_classes, num_folds
+    )
+    num_train = is_train.sum(axis=1)[np.newaxis, :, np.newaxis]
+
+    # Z-score with training-fold statistics, then append a constant for the intercept.
+    means = np.einsum("kn,bnp->bkp", is_train, features) / num_train
+    variances = (
+        np.einsum("kn,bnp->bkp", is_train, features**2) / num_train - means**2
+    )
+    stds = np.sqrt(np.maximum(variances, 1e-12))
+    standardized = (features[:, np.newaxis] - means[:, :, np.newaxis]) / stds[
+        :, :, np.newaxis
+    ]
+    standardized = np.concatenate(
+        [standardized, np.ones((num_batch, num_folds, num_trials, 1))], axis=-1
+    )
+
+    # Step size from the Lipschitz constant of the gradient, using the largest
+    # eigenvalue of each fold's training Gram matrix (by batched power iteration).
+    train_mask = is_train[np.newaxis, :, :, np.newaxis]
+    masked = standardized * train_mask
+    transposed_masked = np.swapaxes(masked, -1, -2)
+    eigenvector = np.ones((num_batch, num_folds, num_features + 1))
+    for _ in range(20):
+        eigenvector = transposed_masked @ (masked @ eigenvector[..., np.newaxis])
+        eigenvector = eigenvector[..., 0]
+        eigenvector /= np.linalg.norm(eigenvector, axis=-1, keepdims=True)
+    largest_eigenvalue = np.sum(
+        (masked @ eigenvector[..., np.newaxis]) ** 2, axis=(-2, -1)
+    )
+    lipschitz = (0.5 * largest_eigenvalue + l2_penalty) / num_train[..., 0]
+    step_sizes = (1 / lipschitz)[..., np.newaxis, np.newaxis]
+
+    weights = np.zeros((num_batch, num_folds, num_features + 1, num_classes))
+    momentum_weights = weights
+    penalty_mask = np.ones(num_features + 1)
+    penalty_mask[-1] = 0
+    for iteration in range(num_iterations):
+        logits = standardized @ momentum_weights
+        logits -= logits.max(axis=-1, keepdims=True)
+        probabilities = np.exp(logits)
+        probabilities /= probabilities.sum(axis=-1, keepdims=True)
+        errors = (probabilities - train_class[np.newaxis]) * train_mask
+        gradient = (transposed_masked @ errors) / num_train[
+            ..., np.newaxis
+        ] + l2_penalty * momentum_weights * penalty_mask[:, np.newaxis] / num_train[
+            ..., np.newaxis
+        ]
+        new_weights = momentum_weights - step_sizes * gradient
+        momentum_weights = new_weights + iteration / (iteration + 3) * (
+            new_weights - weights
+        )
+        weights = new_weights
+
+    scores = standardized @ weights
+
+    return _select_held_out(scores, fold_idxs)
+
+
+_CLASSIFIERS = {"lda": predict_lda, "logistic_regression": predict_logistic_regression}
+
+
+########################################################################################
+#
+# Cross-validated decoding.
+#
+########################################################################################
+
+
+def cross_validate(
+    features, labels, classifier="lda", num_folds=NUM_FOLDS, seed=0, **kwargs
+):
+    """
+    Decode `labels` from `features` (trials x features) with k-fold cross-validation,
+    using `classifier` (`"lda"` or `"logistic_regression"`).
+
+    Returns a dict with the `classes`, held-out `predictions`, `accuracy`, the
+    `confusion_matrix` (true class x predicted class counts, in `classes` order) and
+    the `chance_accuracy` of always guessing the most common class.
+    """
+    if classifier not in _CLASSIFIERS:
+        raise ValueError(f"Unknown classifier: {classifier!r}")
+
+    classes, label_idxs = np.unique(np.asarray(labels), return_inverse=True)
+    fold_idxs = get_stratified_folds(label_idxs, num_folds=num_folds, seed=seed)
+    predicted_idxs = _CLASSIFIERS[classifier](
+        np.asarray(features)[np.newaxis], label_idxs, fold_idxs, len(classes), **kwargs
+    )[0]
+
+    confusion_matrix = np.zeros((len(classes), len(classes)), dtype=np.int64)
+    np.add.at(confusion_matrix, (label_idxs, predicted_idxs), 1)
+
+    return {
+        "classes": classes,
+        "predictions": classes[predicted_idxs],
+        "accuracy": np.mean(predicted_idxs == label_idxs),
+        "confusion_matrix": confusion_matrix,
+        "chance_accuracy": np.bincount(label_idxs).max() / len(label_idxs),
+    }
+
+
+def decode_speech_prompts(
+    speech_go_cue_windows_grouped_by_prompt,
+    electrode_index,
+    classifier="lda",
+    **kwargs,
+):
+    """
+    Decode the prompted word from windows aligned to the speech go cue (e.g., from
+    `compute.get_simultaneous_windows`), using all electrodes and each array's
+    electrodes separately. `electrode_index` is an `arrays.ElectrodeIndex` (or a
+    block's `array_label_by_electrode`, from which one is built).
+
+    Returns a dict of `cross_validate` results keyed by `"all"` and by array label.
+    """
+    if not isinstance(electrode_index, ElectrodeIndex):
+        electrode_index = ElectrodeIndex(electrode_index)
+
+    windows, labels = get_labeled_trials(speech_go_cue_windows_grouped_by_prompt)
+    features = get_window_features(windows)
+
+    features_by_array = {"all": features}
+    for array_label in electrode_index.array_labels:
+        features_by_array[array_label] = electrode_index.select(features, array_label)
+
+    return {
+        array_label: cross_validate(
+            array_features, labels, classifier=classifier, **kwargs
+        )
+        for array_label, array_features in features_by_array.items()
+    }
+
+
+########################################################################################
+#
+# Time-resolved decoding.
+#
+########################################################################################
+
+
+def get_chance_bounds(label_idxs, confidence_level=0.95):
+    """
+    Bounds on the accuracy of a classifier that guesses at chance (the most common
+    class's frequency), from the binomial distribution over the number of trials.
+    """
+    from scipy.stats import binom
+
+    num_trials = len(label_idxs)
+    chance_accuracy = np.bincount(label_idxs).max() / num_trials
+    lower, upper = binom.ppf(
+        [(1 - confidence_level) / 2, (1 + confidence_level) / 2],
+        num_trials,
+        chance_accuracy,
+    )
+
+    return chance_accuracy, np.array([lower, upper]) / num_trials
+
+
+def decode_over_time(
+    windows,
+    labels,
+    num_folds=NUM_FOLDS,
+    seed=0,
+    bins_per_batch=25,
+    **kwargs,
+):
+    """
+    Decode `labels` separately at every bin of aligned windows (trials x bins x
+    electrodes) with cross-validated shrinkage LDA.
+
+    Time bins are the batch axis of `predict_lda`, so all of them (and all folds) are
+    solved as stacked linear algebra. `bins_per_batch` bins go into each batch, which
+    bounds memory at roughly `bins_per_batch * num_folds * electrodes**2` floats.
+
+    Returns a dict with the `relative_timestamps` of the bins, the `accuracy` at each
+    bin, the `chance_accuracy`, and `chance_bounds` (lower, upper).
+    """
+    windows = np.asarray(windows, dtype=np.float64)
+    classes, label_idxs = np.unique(np.asarray(labels), return_inverse=True)
+    fold_idxs = get_stratified_folds(label_idxs, num_folds=num_folds, seed=seed)
+
+    # (bins x trials x electrodes), so each bin is one batch entry.
+    features_by_bin = np.swapaxes(windows, 0, 1)
+    num_bins = len(features_by_bin)
+    accuracy = np.empty(num_bins)
+    for batch_start in range(0, num_bins, bins_per_batch):
+        batch_features = features_by_bin[batch_start : batch_start + bins_per_batch]
+        predicted_idxs = predict_lda(
+            batch_features, label_idxs, fold_idxs, len(classes), **kwargs
+        )
+        accuracy[batch_start : batch_start + len(batch_features)] = np.mean(
+            predicted_idxs == label_idxs, axis=1
+        )
+
+    chance_accuracy, chance_bounds = get_chance_bounds(label_idxs)
+
+    return {
+        "relative_timestamps": compute.get_relative_timestamps()[:num_bins],
+        "accuracy": accuracy,
+        "chance_accuracy": chance_accuracy,
+        "chance_bounds": chance_bounds,
+    }
+
+
+def decode_simultaneous_events_over_time(data, **kwargs):
+    """
+    Run `decode_over_time` for each alignment event of the Simultaneous Speech and
+    Cursor Task: cursor direction aligned to target presentation and to cursor go cue,
+    and speech prompt aligned to speech go cue.
+
+    Returns a dict of `decode_over_time` results keyed by `"target_presentation"`,
+    `"cursor_go_cue"` and `"speech_go_cue"`.
+    """
+    (
+        presentation_windows_grouped_by_direction,
+        cursor_go_cue_windows_grouped_by_direction,
+        speech_go_cue_windows_grouped_by_prompt,
+    ) = compute.get_simultaneous_windows(data)
+
+    windows_grouped_by_event = {
+        "target_presentation": presentation_windows_grouped_by_direction,
+        "cursor_go_cue": cursor_go_cue_windows_grouped_by_direction,
+        "speech_go_cue": speech_go_cue_windows_grouped_by_prompt,
+    }
+
+    return {
+        event: decode_over_time(*get_labeled_trials(windows_grouped), **kwargs)
+        for event, windows_grouped in windows_grouped_by_event.items()
+    }
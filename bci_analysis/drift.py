@@ -0,0 +1,331 @@
+import os
+
+import numpy as np
+
+from bci_analysis import compute, population, tuning
+
+
+########################################################################################
+#
+# Constants.
+#
+########################################################################################
+
+# Number of components kept in each block's covariance sketch, and the number of
+# leading components compared between blocks. The sketch keeps extra components so
+# that merged sketches stay accurate in the compared subspace.
+SKETCH_RANK = 10
+NUM_SUBSPACE_COMPONENTS = 5
+
+DRIFT_DISTANCE_NAMES = ["mean_shift", "subspace_distance", "tuning_distance"]
+
+
+########################################################################################
+#
+# Per-block sufficient statistics.
+#
+########################################################################################
+
+
+class BlockStatistics:
+    """
+    Compact sufficient statistics of one block (or of several merged blocks) of
+    smoothed firing rates (bins x electrodes):
+    - `count`, `mean` and `variance` (per electrode) of the firing rates.
+    - `sketch`: a low-rank factor (rank x electrodes) of the scatter matrix around the
+      mean, so the covariance is approximately `sketch.T @ sketch / count`.
+    - `tuning_xtx` (3 x 3) and `tuning_xty` (3 x electrodes): the normal equations of
+      the cosine tuning fit over the block's tuning trials (see
+      `tuning.get_block_tuning_trials`), which add up across blocks.
+
+    Statistics of different blocks are combined with `merge()` without going back to
+    the blocks' data.
+    """
+
+    def __init__(self, count, mean, variance, sketch, tuning_xtx, tuning_xty):
+        self.count = count
+        self.mean = mean
+        self.variance = variance
+        self.sketch = sketch
+        self.tuning_xtx = tuning_xtx
+        self.tuning_xty = tuning_xty
+
+    @classmethod
+    def from_block(cls, block_data, rank=SKETCH_RANK, seed=0):
+        firing_rates = compute.get_firing_rates(block_data["threshold_crossings"])
+        mean = firing_rates.mean(axis=0)
+        centered = firing_rates - mean
+        _, singular_values, components = population.randomized_svd(
+            centered, rank, seed=seed
+        )
+
+        trial_rates, trial_angles = tuning.get_block_tuning_trials(
+            block_data, firing_rates
+        )
+        design_matrix = tuning.get_design_matrix(trial_angles)
+
+        return cls(
+            count=len(firing_rates),
+            mean=mean,
+            variance=np.mean(centered**2, axis=0),
+            sketch=singular_values[:, np.newaxis] * components,
+            tuning_xtx=design_matrix.T @ design_matrix,
+            tuning_xty=design_matrix.T @ trial_rates,
+        )
+
+    @classmethod
+    def merge(cls, statistics_list, rank=SKETCH_RANK):
+        """
+        Combine the statistics of several blocks. The merged sketch is the top `rank`
+        components of the stacked block sketches plus each block's mean offset.
+        """
+        counts = np.array([statistics.count for statistics in statistics_list])
+        means = np.array([statistics.mean for statistics in statistics_list])
+        count = counts.sum()
+        mean = counts @ means / count
+        mean_offsets = means - mean
+
+        variance = (
+            counts
+            @ (
+                np.array([statistics.variance for statistics in statistics_list])
+                + mean_offsets**2
+            )
+            / count
+        )
+        stacked = np.concatenate(
+            [statistics.sketch for statistics in statistics_list]
+            + [np.sqrt(counts)[:, np.newaxis] * mean_offsets]
+        )
+        _, singular_values, components = np.linalg.svd(stacked, full_matrices=False)
+
+        return cls(
+            count=count,
+            mean=mean,
+            variance=variance,
+            sketch=singular_values[:rank, np.newaxis] * components[:rank],
+            tuning_xtx=sum(statistics.tuning_xtx for statistics in statistics_list),
+            tuning_xty=sum(statistics.tuning_xty for statistics in statistics_list),
+        )
+
+    def get_subspace(self, num_components=NUM_SUBSPACE_COMPONENTS):
+        """
+        Orthonormal rows (components x electrodes) spanning the top principal
+        components of the firing rates.
+        """
+        _, _, components = np.linalg.svd(self.sketch, full_matrices=False)
+
+        return components[:num_components]
+
+    def get_tuning_vectors(self):
+        """
+        Cosine and sine tuning weights (2 x electrodes), or all NaN if the block has
+        too few tuning trials to fit them.
+        """
+        try:
+            coefficients = np.linalg.solve(self.tuning_xtx, self.tuning_xty)
+        except np.linalg.LinAlgError:
+            return np.full((2, self.tuning_xty.shape[1]), np.nan)
+
+        return coefficients[1:]
+
+    def to_arrays(self):
+        return {
+            "count": np.array(self.count),
+            "mean": self.mean,
+            "variance": self.variance,
+            "sketch": self.sketch,
+            "tuning_xtx": self.tuning_xtx,
+            "tuning_xty": self.tuning_xty,
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        arrays = dict(arrays)
+        arrays["count"] = int(arrays["count"])
+
+        return cls(**arrays)
+
+
+########################################################################################
+#
+# Drift distances.
+#
+########################################################################################
+
+
+def get_drift_distances(
+    statistics, other_statistics, num_subspace_components=NUM_SUBSPACE_COMPONENTS
+):
+    """
+    Distances between two sets of `BlockStatistics`:
+    - `mean_shift`: RMS across electrodes of the change in mean firing rate, in units
+      of the electrode's pooled standard deviation.
+    - `subspace_distance`: 1 minus the mean squared cosine of the principal angles
+      between the two blocks' top `num_subspace_components` principal subspaces (0
+      when they are identical, 1 when they are orthogonal).
+    - `tuning_distance`: 1 minus the correlation across electrodes of the cosine tuning
+      vectors (NaN when either block has no tuning fit).
+    """
+    pooled_std = np.sqrt((statistics.variance + other_statistics.variance) / 2)
+    is_active = pooled_std > 0
+    standardized_shift = (
+        other_statistics.mean[is_active] - statistics.mean[is_active]
+    ) / pooled_std[is_active]
+
+    principal_angles = population.get_principal_angles(
+        statistics.get_subspace(num_subspace_components),
+        other_statistics.get_subspace(num_subspace_components),
+    )
+
+    tuning_vectors = statistics.get_tuning_vectors().ravel()
+    other_tuning_vectors = other_statistics.get_tuning_vectors().ravel()
+    if np.all(np.isfinite(tuning_vectors)) and np.all(
+        np.isfinite(other_tuning_vectors)
+    ):
+        tuning_distance = 1 - np.corrcoef(tuning_vectors, other_tuning_vectors)[0, 1]
+    else:
+        tuning_distance = np.nan
+
+    return {
+        "mean_shift": np.sqrt(np.mean(standardized_shift**2)),
+        "subspace_distance": 1 - np.mean(np.cos(principal_angles) ** 2),
+        "tuning_distance": tuning_distance,
+    }
+
+
+def get_consecutive_drift(statistics_by_key):
+    """
+    Drift distances between each pair of consecutive keys (in sorted order). Returns a
+    dict keyed by `(earlier_key, later_key)`.
+    """
+    keys = sorted(statistics_by_key)
+
+    return {
+        (earlier_key, later_key): get_drift_distances(
+            statistics_by_key[earlier_key], statistics_by_key[later_key]
+        )
+        for earlier_key, later_key in zip(keys[:-1], keys[1:])
+    }
+
+
+def get_recalibration_flags(drift, thresholds):
+    """
+    Flag the pairs in `drift` (e.g., from `DriftTracker.get_block_drift`) where any
+    distance exceeds its threshold. `thresholds` maps some of `DRIFT_DISTANCE_NAMES`
+    to a threshold, e.g. chosen from how decoder performance degrades with drift.
+    """
+    return {
+        pair: any(distances[name] > threshold for name, threshold in thresholds.items())
+        for pair, distances in drift.items()
+    }
+
+
+########################################################################################
+#
+# Drift tracker.
+#
+########################################################################################
+
+
+class DriftTracker:
+    """
+    Keep `BlockStatistics` for each block, keyed by `(day, block)`, and report drift
+    between consecutive blocks and sessions.
+
+    Each block's statistics are computed once. With `cache_dirpath`, they are also
+    saved next to the size and modification time of the block file they came from and
+    the sketch `rank`, so later runs only compute statistics for new or changed files
+    (or when the rank changes). Drift is computed from the statistics alone, so adding
+    a block never re-reads earlier blocks.
+    """
+
+    def __init__(self, cache_dirpath=None, rank=SKETCH_RANK):
+        self.cache_dirpath = cache_dirpath
+        self.rank = rank
+        self.statistics_by_block = {}
+
+    def add_block(self, block_id, block_data):
+        statistics = BlockStatistics.from_block(block_data, rank=self.rank)
+        self.statistics_by_block[block_id] = statistics
+
+        return statistics
+
+    def _get_cache_filepath(self, filepath):
+        filename = os.path.splitext(os.path.basename(filepath))[0]
+
+        return os.path.join(self.cache_dirpath, f"{filename}.drift.npz")
+
+    def add_block_file(self, filepath, block_data=None):
+        """
+        Add a block from its file, using the cached statistics if the file hasn't
+        changed since they were computed. If the caller has already loaded the block,
+        passing it as `block_data` avoids loading the file again.
+        """
+        block_id = compute.get_block_id(filepath)
+        if self.cache_dirpath is None:
+            if block_data is None:
+                block_data = compute.load_block(filepath)
+            return self.add_block(block_id, block_data)
+
+        # The statistics depend on the file and on the sketch rank they were built with.
+        file_stat = os.stat(filepath)
+        file_signature = np.array([file_stat.st_size, file_stat.st_mtime_ns])
+        cache_filepath = self._get_cache_filepath(filepath)
+        if os.path.exists(cache_filepath):
+            with np.load(cache_filepath) as cached:
+                if (
+                    np.array_equal(cached["file_signature"], file_signature)
+                    and "rank" in cached
+                    and int(cached["rank"]) == self.rank
+                ):
+                    arrays = {
+                        name: cached[name]
+                        for name in cached.files
+                        if name not in ["file_signature", "rank"]
+                    }
+                    statistics = BlockStatistics.from_arrays(arrays)
+                    self.statistics_by_block[block_id] = statistics
+                    return statistics
+
+        if block_data is None:
+            block_data = compute.load_block(filepath)
+        statistics = self.add_block(block_id, block_data)
+
+        compute.save_npz(
+            cache_filepath,
+            {
+                "file_signature": file_signature,
+                "rank": np.array(self.rank),
+                **statistics.to_arrays(),
+            },
+        )
+
+        return statistics
+
+    def get_session_statistics(self):
+        """
+        Merge the statistics of each day's blocks. Returns a dict keyed by day.
+        """
+        statistics_by_day = {}
+        for (day, _), statistics in self.statistics_by_block.items():
+            statistics_by_day.setdefault(day, []).append(statistics)
+
+        return {
+            day: BlockStatistics.merge(statistics_list, rank=self.rank)
+            for day, statistics_list in statistics_by_day.items()
+        }
+
+    def get_block_drift(self):
+        """
+        Drift distances between consecutive blocks, keyed by `(earlier_block_id,
+        later_block_id)`. Consecutive blocks may be on different days.
+        """
+        return get_consecutive_drift(self.statistics_by_block)
+
+    def get_session_drift(self):
+        """
+        Drift distances between consecutive sessions, keyed by `(earlier_day,
+        later_day)`.
+        """
+        return get_consecutive_drift(self.get_session_statistics())
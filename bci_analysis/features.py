@@ -0,0 +1,150 @@
+import numpy as np
+
+from bci_analysis import compute
+from bci_analysis.streaming import MAX_IN_FLIGHT, RunningMoments, bounded_map
+
+
+########################################################################################
+#
+# Constants.
+#
+########################################################################################
+
+# Neural features concatenated (in this order) into each bin's feature vector, so the
+# first 256 features are threshold crossings and the last 256 are spike band power.
+NEURAL_FEATURE_NAMES = ["threshold_crossings", "spike_band_power"]
+
+NORMALIZATION_MODES = ["zscore", "mean_subtract"]
+
+
+########################################################################################
+#
+# Raw features.
+#
+########################################################################################
+
+
+def get_block_neural_features(block_data):
+    """
+    Concatenate each bin's threshold crossings (scaled to Hz, as in
+    `compute.get_firing_rates` but unsmoothed) and spike band power into one
+    bins x 512 feature matrix.
+    """
+    return np.concatenate(
+        [
+            block_data["threshold_crossings"] / compute.BIN_WIDTH_sec,
+            block_data["spike_band_power"],
+        ],
+        axis=1,
+    ).astype(np.float64)
+
+
+########################################################################################
+#
+# Running normalization.
+#
+########################################################################################
+
+
+class FeatureNormalizer:
+    """
+    Per-feature normalization from running mean and variance statistics.
+
+    `update()` folds new bins (a block, or a single bin in real time) into the
+    statistics, and `transform()` normalizes bins with the statistics so far, either
+    z-scoring (`"zscore"`) or only subtracting the mean (`"mean_subtract"`). Features
+    with zero variance are only mean-subtracted. Normalizers fit on different blocks
+    can be combined with `merge()`.
+    """
+
+    def __init__(self, mode="zscore"):
+        if mode not in NORMALIZATION_MODES:
+            raise ValueError(f"Unknown normalization mode: {mode!r}")
+
+        self.mode = mode
+        self.moments = RunningMoments()
+
+    def update(self, features):
+        self.moments.update(np.atleast_2d(features))
+
+    def merge(self, other):
+        self.moments.merge(other.moments)
+
+    def transform(self, features):
+        if self.moments.count == 0:
+            raise ValueError("Normalizer has no statistics; call update() first")
+
+        centered = np.asarray(features, dtype=np.float64) - self.moments.mean
+        if self.mode == "mean_subtract":
+            return centered
+
+        std = np.sqrt(self.moments.variance)
+        return np.divide(centered, std, out=centered.copy(), where=std > 0)
+
+    def update_and_transform(self, features):
+        """
+        Fold `features` into the statistics, then normalize them. Applied block by
+        block, this normalizes causally in a single pass.
+        """
+        self.update(features)
+        return self.transform(features)
+
+
+def normalize_features(features, mode="zscore"):
+    """
+    Normalize features (bins x features) with statistics over all of their bins.
+    """
+    normalizer = FeatureNormalizer(mode)
+    normalizer.update(features)
+
+    return normalizer.transform(features)
+
+
+def fit_normalizer(data, mode="zscore"):
+    """
+    Fit a `FeatureNormalizer` to the neural features of every block in `data`, one
+    block at a time.
+    """
+    normalizer = FeatureNormalizer(mode)
+    for block_data in data:
+        normalizer.update(get_block_neural_features(block_data))
+
+    return normalizer
+
+
+def _stream_normalized_features(filepaths, normalizer, update, max_in_flight, executor):
+    blocks = bounded_map(compute.load_block, filepaths, max_in_flight, executor)
+    block_features = bounded_map(
+        get_block_neural_features, blocks, max_in_flight, executor
+    )
+    for features in block_features:
+        if update:
+            normalizer.update(features)
+        yield normalizer.transform(features)
+
+
+def stream_normalized_features(
+    filepaths,
+    normalizer=None,
+    mode="zscore",
+    update=True,
+    max_in_flight=MAX_IN_FLIGHT,
+    executor=None,
+):
+    """
+    Return a generator of each block's normalized neural features (bins x 512), loading
+    and extracting features for up to `max_in_flight` blocks ahead on `executor`.
+
+    With `update`, each block is folded into the statistics before it is normalized
+    (a causal, single-pass normalization, starting from `normalizer` if given). Without
+    it, `normalizer` is used as is, e.g. one fit offline with `fit_normalizer` and then
+    applied to new blocks, so it must be given.
+    """
+    if not update and normalizer is None:
+        raise ValueError("A fit normalizer is required when update is False")
+    if normalizer is None:
+        normalizer = FeatureNormalizer(mode)
+
+    return _stream_normalized_features(
+        filepaths, normalizer, update, max_in_flight, executor
+    )
@@ -0,0 +1,532 @@
+"""
+Incrementally ingest new or changed block files into persisted derived data.
+
+Run from the repo root with `python -m bci_analysis.ingest`. Only block files that are
+new, or whose contents changed since the last run, are loaded. Their trial-table rows
+are appended, the trial averages of their days are rebuilt from small per-block
+summaries, and their bitrates and per-block statistics are persisted. Then a short
+report is printed for each ingested block.
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import re
+
+import numpy as np
+
+from bci_analysis import compute, drift
+from bci_analysis.streaming import RunningMoments, TrialAverageAccumulator
+
+
+########################################################################################
+#
+# Constants.
+#
+########################################################################################
+
+DATA_DIRPATH = "./dryad_files"
+DERIVED_DIRPATH = "./derived_files"
+
+HASH_CHUNK_BYTES = 1 << 20
+
+# Trial averages kept per day, with the keys (directions or prompts) they're grouped by.
+TRIAL_AVERAGE_KEYS = {
+    "radial8_trial_start": list(range(8)),
+    "simultaneous_target_presentation": list(range(8)),
+    "simultaneous_cursor_go_cue": list(range(8)),
+    "simultaneous_speech_go_cue": compute.PROMPTS,
+}
+
+# Trial-table fields that only Simultaneous Speech and Cursor Task blocks have, and the
+# values other blocks' rows get.
+_TRIAL_TABLE_FILL_VALUES = {
+    "target_presentation_bin": -1,
+    "cursor_go_cue_bin": -1,
+    "speech_go_cue_bin": -1,
+    "trial_end_bin": -1,
+    "speech_prompt": "",
+    "is_beep_trial": False,
+    "is_control_block": False,
+}
+
+
+########################################################################################
+#
+# Persistence helpers.
+#
+########################################################################################
+
+
+def _save_json(filepath, value):
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    temporary_filepath = f"{filepath}.tmp"
+    with open(temporary_filepath, "w") as f:
+        json.dump(value, f, indent=2, sort_keys=True)
+    os.replace(temporary_filepath, filepath)
+
+
+def _load_json(filepath, default):
+    if not os.path.exists(filepath):
+        return default
+
+    with open(filepath) as f:
+        return json.load(f)
+
+
+def _get_block_name(filepath):
+    return os.path.splitext(os.path.basename(filepath))[0]
+
+
+def _get_summary_filepath(derived_dirpath, block_name):
+    return os.path.join(derived_dirpath, "blocks", f"{block_name}.summary.npz")
+
+
+def _get_trial_averages_filepath(derived_dirpath, day):
+    return os.path.join(derived_dirpath, "trial_averages", f"day{day:05d}.npz")
+
+
+########################################################################################
+#
+# Change detection.
+#
+########################################################################################
+
+
+def get_file_hash(filepath):
+    """
+    SHA-256 of a file's contents, read in chunks.
+    """
+    file_hash = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b""):
+            file_hash.update(chunk)
+
+    return file_hash.hexdigest()
+
+
+def find_changed_block_files(data_dirpath, manifest):
+    """
+    Find block files in `data_dirpath` that are new or changed since they were recorded
+    in `manifest` (a dict of block name to `size`, `mtime_ns` and `sha256`).
+
+    Files whose size and modification time are unchanged are skipped without reading
+    them. Otherwise the file is hashed, and if only its modification time changed, its
+    manifest entry is updated in place and it is not reported. Returns a list of
+    `(filepath, file_entry)` for the new or changed files.
+    """
+    changed = []
+    for filepath in sorted(glob.glob(os.path.join(data_dirpath, "*.mat"))):
+        block_name = _get_block_name(filepath)
+        file_stat = os.stat(filepath)
+        file_entry = {"size": file_stat.st_size, "mtime_ns": file_stat.st_mtime_ns}
+
+        recorded_entry = manifest.get(block_name)
+        if recorded_entry is not None and all(
+            recorded_entry[name] == value for name, value in file_entry.items()
+        ):
+            continue
+
+        file_entry["sha256"] = get_file_hash(filepath)
+        if recorded_entry is not None and recorded_entry["sha256"] == (
+            file_entry["sha256"]
+        ):
+            recorded_entry.update(file_entry)
+            continue
+
+        changed.append((filepath, file_entry))
+
+    return changed
+
+
+########################################################################################
+#
+# Per-block products.
+#
+########################################################################################
+
+
+def get_block_task(filepath):
+    """
+    Get the task of a block file from its name, e.g. `radial8_calibration_task`.
+    """
+    match = re.search(r"_block\d+_(.+)$", _get_block_name(filepath))
+
+    return match.group(1) if match is not None else ""
+
+
+def convert_block(block_data):
+    """
+    Convert a block loaded from its `.mat` file into arrays that can be saved with
+    `np.savez` and loaded without pickling. MATLAB metadata is dropped, and cell arrays
+    of strings (e.g. `speech_prompt`) become string arrays of the same shape. The
+    converted block works with the same `compute` functions as the original.
+    """
+    converted = {}
+    for name, value in block_data.items():
+        if name.startswith("__"):
+            continue
+        if value.dtype == object:
+            value = np.array([element.item() for element in value.flatten()]).reshape(
+                value.shape
+            )
+        converted[name] = value
+
+    return converted
+
+
+def load_converted_block(block_name, derived_dirpath=DERIVED_DIRPATH):
+    """
+    Load a block converted by `ingest`, which is much faster than loading its `.mat`
+    file.
+    """
+    filepath = os.path.join(derived_dirpath, "blocks", f"{block_name}.npz")
+    with np.load(filepath) as converted:
+        return dict(converted)
+
+
+def get_block_trial_table_rows(block_name, block_data):
+    """
+    Get a block's trial table (see `compute.get_trial_table`) as rows of the persisted
+    trial table, with the block's name, day and block numbers, and each trial's index.
+    Fields the block doesn't have get the values in `_TRIAL_TABLE_FILL_VALUES`.
+    """
+    trial_table = compute.get_trial_table(block_data)
+    num_trials = len(trial_table["trial_start_bin"])
+    day, block = compute.get_block_id(block_name)
+
+    rows = {
+        "block_name": np.full(num_trials, block_name),
+        "day": np.full(num_trials, day),
+        "block": np.full(num_trials, block),
+        "trial_idx": np.arange(num_trials),
+    }
+    rows.update(trial_table)
+    for name, fill_value in _TRIAL_TABLE_FILL_VALUES.items():
+        if name not in rows:
+            rows[name] = np.full(num_trials, fill_value)
+
+    return rows
+
+
+def get_block_trial_average_moments(task, block_data):
+    """
+    Running moments of the block's aligned windows for each of `TRIAL_AVERAGE_KEYS`
+    that applies to the block's task. Returns a dict keyed by analysis of lists of
+    `RunningMoments`, one per key.
+    """
+    trial_table = compute.get_trial_table(block_data)
+    firing_rates = compute.get_firing_rates(block_data["threshold_crossings"])
+
+    if task == "radial8_calibration_task":
+        windows_grouped_by_analysis = {
+            "radial8_trial_start": compute.get_radial8_block_windows(
+                trial_table, firing_rates
+            )
+        }
+    elif task == "simultaneous_speech_and_cursor_task":
+        windows_grouped_by_analysis = dict(
+            zip(
+                [
+                    "simultaneous_target_presentation",
+                    "simultaneous_cursor_go_cue",
+                    "simultaneous_speech_go_cue",
+                ],
+                compute.get_simultaneous_block_windows(trial_table, firing_rates),
+            )
+        )
+    else:
+        windows_grouped_by_analysis = {}
+
+    moments_by_analysis = {}
+    for analysis, windows_grouped in windows_grouped_by_analysis.items():
+        moments_by_analysis[analysis] = []
+        for key in TRIAL_AVERAGE_KEYS[analysis]:
+            moments = RunningMoments()
+            moments.update(windows_grouped[key])
+            moments_by_analysis[analysis].append(moments)
+
+    return moments_by_analysis
+
+
+def _get_moments_arrays(analysis, moments_list):
+    return {
+        f"{analysis}_count": np.array([moments.count for moments in moments_list]),
+        f"{analysis}_mean": np.array([moments.mean for moments in moments_list]),
+        f"{analysis}_m2": np.array(
+            [moments.sum_of_squared_deviations for moments in moments_list]
+        ),
+    }
+
+
+def _get_moments_list(arrays, analysis):
+    moments_list = []
+    for count, mean, m2 in zip(
+        arrays[f"{analysis}_count"],
+        arrays[f"{analysis}_mean"],
+        arrays[f"{analysis}_m2"],
+    ):
+        moments = RunningMoments()
+        moments.count = int(count)
+        moments.mean = mean
+        moments.sum_of_squared_deviations = m2
+        moments_list.append(moments)
+
+    return moments_list
+
+
+def get_block_summary(filepath, block_data):
+    """
+    Everything a block contributes to the persisted aggregates, as arrays: trial
+    average moments (`{analysis}_count`, `_mean`, `_m2`), its number of trials and, for
+    Grid Evaluation Task blocks, its bitrate. The block's `drift.BlockStatistics` are
+    cached separately by `drift.DriftTracker`.
+    """
+    task = get_block_task(filepath)
+    summary = {
+        "num_trials": np.array(block_data["trial_start_bin"].size),
+    }
+    for analysis, moments_list in get_block_trial_average_moments(
+        task, block_data
+    ).items():
+        summary.update(_get_moments_arrays(analysis, moments_list))
+
+    if task == "grid_evaluation_task":
+        summary["bitrate"] = np.array(
+            compute.get_grid_block_results(block_data)["bitrate"]
+        )
+
+    return summary
+
+
+########################################################################################
+#
+# Persisted aggregates.
+#
+########################################################################################
+
+
+def load_manifest(derived_dirpath=DERIVED_DIRPATH):
+    return _load_json(os.path.join(derived_dirpath, "manifest.json"), {})
+
+
+def load_trial_table(derived_dirpath=DERIVED_DIRPATH):
+    """
+    Load the persisted trial table of every ingested block, as a dict of arrays with
+    one entry per trial.
+    """
+    filepath = os.path.join(derived_dirpath, "trial_table.npz")
+    if not os.path.exists(filepath):
+        return {}
+
+    with np.load(filepath) as trial_table:
+        return dict(trial_table)
+
+
+def load_trial_averages(day, derived_dirpath=DERIVED_DIRPATH):
+    """
+    Load the persisted trial averages of a day. Returns a dict keyed by analysis (see
+    `TRIAL_AVERAGE_KEYS`) of `(trial_averaged, sem)` pairs, like
+    `compute.get_trial_averages`.
+    """
+    with np.load(_get_trial_averages_filepath(derived_dirpath, day)) as arrays:
+        trial_averages = {}
+        for analysis, keys in TRIAL_AVERAGE_KEYS.items():
+            if f"{analysis}_count" not in arrays:
+                continue
+            accumulator = TrialAverageAccumulator()
+            accumulator.moments_by_key = dict(
+                zip(keys, _get_moments_list(arrays, analysis))
+            )
+            trial_averages[analysis] = accumulator.get_trial_averages()
+
+    return trial_averages
+
+
+def load_bitrate_series(derived_dirpath=DERIVED_DIRPATH):
+    """
+    Load the bitrate of every ingested Grid Evaluation Task block, as a list of
+    `(day, block, bitrate)` sorted by day and block.
+    """
+    bitrates = _load_json(os.path.join(derived_dirpath, "bitrates.json"), {})
+
+    return sorted(
+        (entry["day"], entry["block"], entry["bitrate"]) for entry in bitrates.values()
+    )
+
+
+def _update_trial_table(derived_dirpath, block_rows):
+    trial_table = load_trial_table(derived_dirpath)
+    if trial_table:
+        # Drop the earlier rows of re-ingested blocks.
+        is_kept = ~np.isin(trial_table["block_name"], list(block_rows))
+        trial_table = {name: column[is_kept] for name, column in trial_table.items()}
+
+    tables = ([trial_table] if trial_table else []) + list(block_rows.values())
+    compute.save_npz(
+        os.path.join(derived_dirpath, "trial_table.npz"),
+        {name: np.concatenate([table[name] for table in tables]) for name in tables[0]},
+    )
+
+
+def _rebuild_trial_averages(derived_dirpath, day, block_names):
+    # Build the day's aggregate from its blocks' summaries (without loading any block).
+    # The aggregate is always rebuilt rather than merged into, so re-ingesting a block,
+    # e.g. after an interrupted run, never counts its trials twice.
+    moments_by_analysis = {}
+    for block_name in block_names:
+        with np.load(_get_summary_filepath(derived_dirpath, block_name)) as summary:
+            for analysis in TRIAL_AVERAGE_KEYS:
+                if f"{analysis}_count" not in summary:
+                    continue
+                block_moments_list = _get_moments_list(summary, analysis)
+                if analysis not in moments_by_analysis:
+                    moments_by_analysis[analysis] = block_moments_list
+                    continue
+                for moments, block_moments in zip(
+                    moments_by_analysis[analysis], block_moments_list
+                ):
+                    moments.merge(block_moments)
+
+    arrays = {}
+    for analysis, moments_list in moments_by_analysis.items():
+        arrays.update(_get_moments_arrays(analysis, moments_list))
+    compute.save_npz(_get_trial_averages_filepath(derived_dirpath, day), arrays)
+
+
+########################################################################################
+#
+# Ingestion.
+#
+########################################################################################
+
+
+def ingest(data_dirpath=DATA_DIRPATH, derived_dirpath=DERIVED_DIRPATH):
+    """
+    Ingest the new or changed block files in `data_dirpath` into `derived_dirpath`:
+    - `blocks/<block>.npz`: the converted block (see `load_converted_block`).
+    - `blocks/<block>.summary.npz`: the block's contributions (see `get_block_summary`).
+    - `blocks/<block>.drift.npz`: the block's drift statistics, cached by
+      `drift.DriftTracker`.
+    - `trial_table.npz`: trial-table rows of every block (see `load_trial_table`).
+    - `trial_averages/day<day>.npz`: per-day trial averages (see `load_trial_averages`).
+    - `bitrates.json`: bitrate of every Grid Evaluation Task block.
+    - `manifest.json`: size, modification time and hash of every ingested file.
+
+    Already ingested blocks are neither loaded nor recomputed; the days of ingested
+    blocks get their trial averages rebuilt from the per-block summaries. The manifest
+    is written last, so an interrupted run re-ingests the same files next time, and
+    since every output is keyed by block or rebuilt, re-ingesting them is harmless.
+
+    Returns a report for each ingested block: its name, task, number of trials, bitrate
+    (Grid Evaluation Task blocks only), and its drift from the previous block (see
+    `drift.get_drift_distances`), if there is one.
+    """
+    manifest = load_manifest(derived_dirpath)
+    changed_files = find_changed_block_files(data_dirpath, manifest)
+
+    block_rows = {}
+    bitrates = _load_json(os.path.join(derived_dirpath, "bitrates.json"), {})
+    drift_tracker = drift.DriftTracker(os.path.join(derived_dirpath, "blocks"))
+    for filepath, file_entry in changed_files:
+        block_name = _get_block_name(filepath)
+        block_data = convert_block(compute.load_block(filepath))
+        compute.save_npz(
+            os.path.join(derived_dirpath, "blocks", f"{block_name}.npz"), block_data
+        )
+        summary = get_block_summary(filepath, block_data)
+        compute.save_npz(_get_summary_filepath(derived_dirpath, block_name), summary)
+        drift_tracker.add_block_file(filepath, block_data)
+        block_rows[block_name] = get_block_trial_table_rows(block_name, block_data)
+
+        if "bitrate" in summary:
+            day, block = compute.get_block_id(block_name)
+            bitrates[block_name] = {
+                "day": day,
+                "block": block,
+                "bitrate": float(summary["bitrate"]),
+            }
+
+        file_entry["task"] = get_block_task(filepath)
+        manifest[block_name] = file_entry
+
+    if block_rows:
+        _update_trial_table(derived_dirpath, block_rows)
+
+        days = {compute.get_block_id(block_name)[0] for block_name in block_rows}
+        for day in sorted(days):
+            day_block_names = sorted(
+                (
+                    block_name
+                    for block_name in manifest
+                    if compute.get_block_id(block_name)[0] == day
+                ),
+                key=compute.get_block_id,
+            )
+            _rebuild_trial_averages(derived_dirpath, day, day_block_names)
+
+    _save_json(os.path.join(derived_dirpath, "bitrates.json"), bitrates)
+    _save_json(os.path.join(derived_dirpath, "manifest.json"), manifest)
+
+    # Report drift from the previous block (in day and block order) of each ingested
+    # block, from the cached per-block statistics.
+    sorted_block_names = sorted(manifest, key=compute.get_block_id)
+    reports = []
+    for block_name in sorted(block_rows, key=compute.get_block_id):
+        report = {
+            "block_name": block_name,
+            "task": manifest[block_name]["task"],
+            "num_trials": len(block_rows[block_name]["trial_idx"]),
+        }
+        if block_name in bitrates:
+            report["bitrate"] = bitrates[block_name]["bitrate"]
+
+        block_position = sorted_block_names.index(block_name)
+        if block_position > 0:
+            previous_block_name = sorted_block_names[block_position - 1]
+            report["previous_block_name"] = previous_block_name
+            report["drift"] = drift.get_drift_distances(
+                drift_tracker.add_block_file(
+                    os.path.join(data_dirpath, f"{previous_block_name}.mat")
+                ),
+                drift_tracker.add_block_file(
+                    os.path.join(data_dirpath, f"{block_name}.mat")
+                ),
+            )
+        reports.append(report)
+
+    return reports
+
+
+def _format_report(report):
+    line = f"{report['block_name']}: {report['num_trials']} trials"
+    if "bitrate" in report:
+        line += f", bitrate {report['bitrate']:.2f} bps"
+    if "drift" in report:
+        distances = ", ".join(
+            f"{name} {value:.3f}" for name, value in report["drift"].items()
+        )
+        line += f", drift from {report['previous_block_name']}: {distances}"
+
+    return line
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Ingest new or changed block files into the derived data."
+    )
+    parser.add_argument("--data-dirpath", default=DATA_DIRPATH)
+    parser.add_argument("--derived-dirpath", default=DERIVED_DIRPATH)
+    args = parser.parse_args(argv)
+
+    reports = ingest(args.data_dirpath, args.derived_dirpath)
+    if not reports:
+        print("No new or changed blocks.")
+    for report in reports:
+        print(_format_report(report))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,356 @@
+import numpy as np
+
+from bci_analysis import compute, features
+from bci_analysis.latency import get_cursor_velocity
+
+
+########################################################################################
+#
+# Constants.
+#
+########################################################################################
+
+# Window (relative to the speech go cue) over which the perturbation is measured.
+INTERFERENCE_WINDOW_START_sec = 0.0
+INTERFERENCE_WINDOW_END_sec = 1.0
+
+# A bin counts towards the perturbation's duration when its perturbation magnitude is
+# above this percentile of the no-beep trials' magnitudes at that bin.
+DURATION_THRESHOLD_PERCENTILE = 95
+
+INTERFERENCE_CONDITIONS = [
+    "control_nobeep",
+    "control_beep",
+    "verbal_nobeep",
+    "verbal_beep",
+]
+INTERFERENCE_SIGNALS = ["decoder_output", "cursor_velocity"]
+
+DECODER_RIDGE_PENALTY = 1.0
+
+
+########################################################################################
+#
+# Aligned trials.
+#
+########################################################################################
+
+
+def _get_target_frame(vectors, target_directions):
+    # Rotate (trials x bins x 2) vectors so the first component points towards each
+    # trial's target and the second is the (signed) off-target component.
+    towards = target_directions[:, np.newaxis, :]
+    on_target = np.sum(vectors * towards, axis=-1)
+    off_target = towards[..., 0] * vectors[..., 1] - towards[..., 1] * vectors[..., 0]
+
+    return np.stack([on_target, off_target], axis=-1)
+
+
+def get_interference_trials(data, normalizer=None):
+    """
+    Align `cursor_decoder_output` and cursor velocity to the speech go cue of every
+    trial of every Simultaneous Speech and Cursor Task block in `data`.
+
+    No-beep trials have no speech go cue, so they are aligned to a matched time instead:
+    their cursor go cue plus the median delay from cursor go cue to speech go cue of
+    the beep trials in the same kind of block (verbal or control). Trials where the
+    cursor starts on the target are skipped.
+
+    The window of every kept trial is found first, then each block's windows are cut
+    from that block's own signals with one gather, so signals covering every bin of the
+    session are never built. Windows that would cross a block boundary are skipped, and
+    bins after the end of a trial are set to NaN. With a `features.FeatureNormalizer`,
+    the neural features (bins x 512) are gathered too and normalized after the gather,
+    for `get_electrode_attribution`.
+
+    Returns a dict of per-trial arrays: `condition` (one of `INTERFERENCE_CONDITIONS`),
+    `is_control_block`, `is_beep_trial`, `direction_idx`, `block_idx`,
+    `target_direction` (unit vector from the cursor to the target at the cursor go
+    cue), and the aligned (trials x bins x channels) `decoder_output`,
+    `cursor_velocity` and optionally `neural_features`.
+    """
+    trial_tables = [compute.get_trial_table(block_data) for block_data in data]
+
+    def concatenate_field(name):
+        return np.concatenate([trial_table[name] for trial_table in trial_tables])
+
+    # Event bins are relative to the start of each trial's block.
+    block_idxs = np.concatenate(
+        [
+            np.full(len(trial_table["cursor_go_cue_bin"]), block_idx)
+            for block_idx, trial_table in enumerate(trial_tables)
+        ]
+    )
+    block_num_bins = np.array([len(block_data["timestamp_sec"]) for block_data in data])
+    cursor_go_cue_bins = concatenate_field("cursor_go_cue_bin")
+    speech_go_cue_bins = concatenate_field("speech_go_cue_bin")
+    trial_end_bins = concatenate_field("trial_end_bin")
+    is_beep_trial = concatenate_field("is_beep_trial")
+    is_control_block = concatenate_field("is_control_block")
+
+    # Matched event times for no-beep trials.
+    event_bins = speech_go_cue_bins.copy()
+    for is_control in [False, True]:
+        is_block_type = is_control_block == is_control
+        speech_delays = (speech_go_cue_bins - cursor_go_cue_bins)[
+            is_block_type & is_beep_trial
+        ]
+        if len(speech_delays) == 0:
+            continue
+        is_matched = is_block_type & ~is_beep_trial
+        event_bins[is_matched] = cursor_go_cue_bins[is_matched] + int(
+            np.median(speech_delays)
+        )
+
+    movement_vectors = np.concatenate(
+        [
+            block_data["target_position"][trial_table["cursor_go_cue_bin"]]
+            - block_data["cursor_position"][trial_table["cursor_go_cue_bin"]]
+            for block_data, trial_table in zip(data, trial_tables)
+        ]
+    )
+    movement_lengths = np.linalg.norm(movement_vectors, axis=1)
+
+    pre_bins = compute.PRE_GO_CUE_bins
+    post_bins = compute.POST_GO_CUE_bins
+    trial_idxs = np.flatnonzero(
+        (movement_lengths > 0)
+        & (event_bins != -1)
+        & (event_bins - pre_bins >= 0)
+        & (event_bins + post_bins <= block_num_bins[block_idxs])
+    )
+    window_bins = event_bins[trial_idxs, np.newaxis] + np.arange(-pre_bins, post_bins)
+
+    signal_names = list(INTERFERENCE_SIGNALS)
+    if normalizer is not None:
+        signal_names.append("neural_features")
+    aligned_by_name = {}
+    for block_idx, block_data in enumerate(data):
+        block_signals = {
+            "decoder_output": block_data["cursor_decoder_output"],
+            "cursor_velocity": get_cursor_velocity(block_data["cursor_position"]),
+        }
+        if normalizer is not None:
+            block_signals["neural_features"] = features.get_block_neural_features(
+                block_data
+            )
+
+        is_block_trial = block_idxs[trial_idxs] == block_idx
+        for name in signal_names:
+            signal = block_signals[name]
+            if name not in aligned_by_name:
+                aligned_by_name[name] = np.empty(
+                    (len(trial_idxs), pre_bins + post_bins, signal.shape[1])
+                )
+            aligned_by_name[name][is_block_trial] = signal[window_bins[is_block_trial]]
+
+    if normalizer is not None:
+        aligned_by_name["neural_features"] = normalizer.transform(
+            aligned_by_name["neural_features"]
+        )
+
+    # Bins after the trial ended belong to the next trial.
+    is_after_trial_end = window_bins > trial_end_bins[trial_idxs, np.newaxis]
+    for aligned in aligned_by_name.values():
+        aligned[is_after_trial_end] = np.nan
+
+    block_types = np.where(is_control_block[trial_idxs], "control", "verbal")
+    trial_types = np.where(is_beep_trial[trial_idxs], "beep", "nobeep")
+    trials = {
+        "condition": np.char.add(np.char.add(block_types, "_"), trial_types),
+        "is_control_block": is_control_block[trial_idxs],
+        "is_beep_trial": is_beep_trial[trial_idxs],
+        "direction_idx": concatenate_field("direction_idx")[trial_idxs],
+        "block_idx": block_idxs[trial_idxs],
+        "target_direction": (
+            movement_vectors[trial_idxs] / movement_lengths[trial_idxs, np.newaxis]
+        ),
+    }
+    trials.update(aligned_by_name)
+
+    return trials
+
+
+########################################################################################
+#
+# Perturbation metrics.
+#
+########################################################################################
+
+
+def _get_window_mask(window_start_sec, window_end_sec):
+    relative_timestamps = compute.get_relative_timestamps()
+
+    return (relative_timestamps >= window_start_sec) & (
+        relative_timestamps < window_end_sec
+    )
+
+
+def get_perturbations(
+    trials,
+    signal_name="decoder_output",
+    window_start_sec=INTERFERENCE_WINDOW_START_sec,
+    window_end_sec=INTERFERENCE_WINDOW_END_sec,
+    threshold_percentile=DURATION_THRESHOLD_PERCENTILE,
+):
+    """
+    Measure how much `signal_name` (`"decoder_output"` or `"cursor_velocity"`) deviates
+    from its matched no-beep baseline after the (matched) speech go cue.
+
+    Each trial's signal is rotated into its target frame (towards the target, and
+    off-target), and the baseline is the average no-beep trajectory in the same kind of
+    block. Per trial, over the window:
+    - `magnitude`: mean norm of the perturbation.
+    - `off_target`: mean absolute off-target component of the perturbation.
+    - `duration_sec`: time the perturbation norm is above `threshold_percentile` of
+      the no-beep trials' norms at the same bin.
+
+    No-beep trials get the same metrics, as a reference. Returns a dict with the
+    per-trial `perturbation` (trials x bins x 2, in the target frame) and metrics.
+    """
+    in_target_frame = _get_target_frame(trials[signal_name], trials["target_direction"])
+    is_in_window = _get_window_mask(window_start_sec, window_end_sec)
+
+    perturbation = np.full_like(in_target_frame, np.nan)
+    duration_sec = np.zeros(len(in_target_frame))
+    for is_control in [False, True]:
+        is_block_type = trials["is_control_block"] == is_control
+        is_baseline = is_block_type & ~trials["is_beep_trial"]
+        if not np.any(is_baseline):
+            continue
+
+        baseline = np.nanmean(in_target_frame[is_baseline], axis=0)
+        perturbation[is_block_type] = in_target_frame[is_block_type] - baseline
+
+        norms = np.linalg.norm(perturbation[is_block_type], axis=-1)
+        threshold = np.nanpercentile(
+            np.linalg.norm(perturbation[is_baseline], axis=-1),
+            threshold_percentile,
+            axis=0,
+        )
+        duration_sec[is_block_type] = (
+            np.sum((norms > threshold)[:, is_in_window], axis=1) * compute.BIN_WIDTH_sec
+        )
+
+    windowed = perturbation[:, is_in_window]
+    with np.errstate(invalid="ignore"):
+        return {
+            "perturbation": perturbation,
+            "magnitude": np.nanmean(np.linalg.norm(windowed, axis=-1), axis=1),
+            "off_target": np.nanmean(np.abs(windowed[..., 1]), axis=1),
+            "duration_sec": duration_sec,
+        }
+
+
+def get_interference_by_condition(trials, **kwargs):
+    """
+    Run `get_perturbations` for each of `INTERFERENCE_SIGNALS` and group the per-trial
+    metrics by condition. Returns a dict keyed by signal, then metric, of dicts keyed
+    by `INTERFERENCE_CONDITIONS`. Each metric's dict can be passed to
+    `stats.compare_conditions` (e.g., `verbal_beep` vs `verbal_nobeep`).
+    """
+    interference = {}
+    for signal_name in INTERFERENCE_SIGNALS:
+        perturbations = get_perturbations(trials, signal_name, **kwargs)
+        interference[signal_name] = {
+            metric: {
+                condition: values[
+                    (trials["condition"] == condition) & np.isfinite(values)
+                ]
+                for condition in INTERFERENCE_CONDITIONS
+            }
+            for metric, values in perturbations.items()
+            if metric != "perturbation"
+        }
+
+    return interference
+
+
+########################################################################################
+#
+# Per-electrode attribution.
+#
+########################################################################################
+
+
+def fit_decoder_weights(data, normalizer, ridge_penalty=DECODER_RIDGE_PENALTY):
+    """
+    Estimate linear decoder weights (features x 2) from normalized neural features to
+    `cursor_decoder_output`, by ridge regression over every bin of `data`. The block
+    files don't include the online decoder's weights, so this is its best linear
+    approximation. The normal equations are accumulated one block at a time.
+    """
+    num_features = (
+        len(features.NEURAL_FEATURE_NAMES) * data[0]["threshold_crossings"].shape[1]
+    )
+    xtx = np.zeros((num_features + 1, num_features + 1))
+    xty = np.zeros((num_features + 1, 2))
+    for block_data in data:
+        neural_features = normalizer.transform(
+            features.get_block_neural_features(block_data)
+        )
+        design = np.column_stack([neural_features, np.ones(len(neural_features))])
+        xtx += design.T @ design
+        xty += design.T @ block_data["cursor_decoder_output"]
+
+    # Don't penalize the intercept.
+    penalty = ridge_penalty * np.eye(num_features + 1)
+    penalty[-1, -1] = 0
+
+    return np.linalg.solve(xtx + penalty, xty)[:-1]
+
+
+def get_electrode_attribution(
+    trials,
+    decoder_weights,
+    window_start_sec=INTERFERENCE_WINDOW_START_sec,
+    window_end_sec=INTERFERENCE_WINDOW_END_sec,
+):
+    """
+    Attribute the decoded perturbation of beep trials to electrodes, through the
+    decoder weights (features x 2, e.g. from `fit_decoder_weights`). `trials` must
+    include `neural_features` (see `get_interference_trials`).
+
+    Each trial's neural features are compared with the average no-beep trial to the
+    same target direction in the same kind of block. Feature `f` contributes
+    `delta_f * w_f` to the decoded perturbation `P`, and its attribution is its share of
+    `sum |P|^2`, i.e. `sum(delta_f * w_f . P) / sum(P . P)` over trials and window bins,
+    so attributions sum to 1. Threshold crossing and spike band power shares are added
+    per electrode.
+
+    Returns a dict keyed by beep condition (`verbal_beep`, `control_beep`) of
+    per-electrode attributions.
+    """
+    neural_features = trials["neural_features"]
+    num_features = neural_features.shape[-1]
+    is_in_window = _get_window_mask(window_start_sec, window_end_sec)
+
+    # Direction- and block-type-matched no-beep baselines.
+    group_idxs = 8 * trials["is_control_block"] + trials["direction_idx"]
+    deltas = np.full_like(neural_features[:, is_in_window], np.nan)
+    for group_idx in np.unique(group_idxs):
+        is_group = group_idxs == group_idx
+        is_baseline = is_group & ~trials["is_beep_trial"]
+        if not np.any(is_baseline):
+            continue
+        baseline = np.nanmean(neural_features[is_baseline][:, is_in_window], axis=0)
+        deltas[is_group] = neural_features[is_group][:, is_in_window] - baseline
+
+    attribution = {}
+    for condition in ["verbal_beep", "control_beep"]:
+        condition_deltas = deltas[trials["condition"] == condition].reshape(
+            -1, num_features
+        )
+        condition_deltas = condition_deltas[
+            np.all(np.isfinite(condition_deltas), axis=1)
+        ]
+        perturbation = condition_deltas @ decoder_weights
+        feature_shares = np.sum(
+            condition_deltas * (perturbation @ decoder_weights.T), axis=0
+        ) / np.sum(perturbation**2)
+
+        attribution[condition] = feature_shares.reshape(
+            len(features.NEURAL_FEATURE_NAMES), -1
+        ).sum(axis=0)
+
+    return attribution
@@ -0,0 +1,216 @@
+import numpy as np
+
+from bci_analysis import compute
+
+
+########################################################################################
+#
+# Constants.
+#
+########################################################################################
+
+# Lags (in both directions) over which neural features are cross-correlated with
+# movement signals.
+MAX_LAG_sec = 0.5
+MAX_LAG_bins = int(MAX_LAG_sec / compute.BIN_WIDTH_sec)
+
+# Movement signals that neural features are cross-correlated with.
+MOVEMENT_SIGNALS = ["decoder_output", "cursor_velocity"]
+
+
+########################################################################################
+#
+# Movement signals.
+#
+########################################################################################
+
+
+def get_cursor_velocity(cursor_position):
+    """
+    Cursor velocity (per second) at each bin, from the cursor position (bins x 2).
+    """
+    return np.gradient(cursor_position, compute.BIN_WIDTH_sec, axis=0)
+
+
+def get_movement_signals(block_data):
+    """
+    Get each of `MOVEMENT_SIGNALS` (bins x 2) for a block.
+    """
+    return {
+        "decoder_output": block_data["cursor_decoder_output"],
+        "cursor_velocity": get_cursor_velocity(block_data["cursor_position"]),
+    }
+
+
+########################################################################################
+#
+# Lagged cross-correlation.
+#
+########################################################################################
+
+
+def _zscore(signals):
+    # Constant channels get all zeros, so their correlation with anything is 0.
+    signals = np.asarray(signals, dtype=np.float64)
+    std = signals.std(axis=0)
+    centered = signals - signals.mean(axis=0)
+
+    return np.divide(centered, std, out=np.zeros_like(centered), where=std > 0)
+
+
+def get_lagged_correlations(
+    neural_features, movement, max_lag_bins=MAX_LAG_bins, chunk_bins=None
+):
+    """
+    Pearson correlation between every neural feature (bins x electrodes) and every
+    movement dimension (bins x dimensions) at every lag from `-max_lag_bins` to
+    `max_lag_bins`. A positive lag means neural activity leads movement, i.e. the
+    feature at bin `t` is paired with movement at bin `t + lag`.
+
+    All electrodes and dimensions are correlated together with one batched FFT
+    cross-correlation. With `chunk_bins`, the block is processed in chunks of that many
+    bins (each padded with `max_lag_bins` of movement on both sides, so the result is
+    exact), which bounds memory for long sessions.
+
+    Returns the lags (bins) and the correlations (lags x electrodes x dimensions).
+    """
+    from scipy.fft import irfft, next_fast_len, rfft
+
+    neural_features = _zscore(neural_features)
+    movement = _zscore(movement)
+    total_bins = len(neural_features)
+    if chunk_bins is None:
+        chunk_bins = total_bins
+
+    # Pad the movement so every chunk can see `max_lag_bins` beyond each of its ends.
+    padded_movement = np.pad(movement, ((max_lag_bins, max_lag_bins), (0, 0)))
+
+    num_lags = 2 * max_lag_bins + 1
+    summed_products = np.zeros((num_lags, neural_features.shape[1], movement.shape[1]))
+    for chunk_start in range(0, total_bins, chunk_bins):
+        chunk_end = min(chunk_start + chunk_bins, total_bins)
+        neural_chunk = neural_features[chunk_start:chunk_end]
+        movement_chunk = padded_movement[chunk_start : chunk_end + 2 * max_lag_bins]
+
+        # The FFT is long enough that the circular correlation doesn't wrap around for
+        # any of the lags that are kept.
+        fft_length = next_fast_len(len(movement_chunk), real=True)
+        neural_spectrum = rfft(neural_chunk, n=fft_length, axis=0)
+        movement_spectrum = rfft(movement_chunk, n=fft_length, axis=0)
+        cross_spectrum = (
+            np.conj(neural_spectrum)[:, :, np.newaxis]
+            * movement_spectrum[:, np.newaxis, :]
+        )
+        summed_products += irfft(cross_spectrum, n=fft_length, axis=0)[:num_lags]
+
+    lags = np.arange(-max_lag_bins, max_lag_bins + 1)
+    num_pairs = total_bins - np.abs(lags)
+
+    return lags, summed_products / num_pairs[:, np.newaxis, np.newaxis]
+
+
+def get_movement_correlation(movement):
+    """
+    Correlation matrix (dimensions x dimensions) of the movement dimensions, for
+    `get_peak_lags`.
+    """
+    movement = _zscore(movement)
+
+    return movement.T @ movement / len(movement)
+
+
+def get_peak_lags(lags, correlations, movement_correlation):
+    """
+    Find each electrode's peak lag and peak correlation from the output of
+    `get_lagged_correlations`. At each lag, the correlations with the movement
+    dimensions are combined into the largest correlation with any linear combination of
+    them, `sqrt(c^T R^-1 c)`, where `R` is the `movement_correlation` matrix (see
+    `get_movement_correlation`), i.e. the correlation with the movement direction the
+    electrode is most related to. Unlike the root sum of squares of `c`, this stays a
+    correlation when the dimensions are correlated with each other (up to the small
+    error from using whole-block statistics at every lag).
+
+    Returns the peak lag (seconds) and the peak correlation, both per electrode.
+    """
+    # A pseudo-inverse, so constant (all-zero) movement dimensions are ignored.
+    whitened = np.einsum(
+        "lei,ij,lej->le",
+        correlations,
+        np.linalg.pinv(movement_correlation),
+        correlations,
+    )
+    magnitude = np.sqrt(np.clip(whitened, 0, None))
+    peak_lag_idxs = np.argmax(magnitude, axis=0)
+    electrode_idxs = np.arange(magnitude.shape[1])
+
+    return (
+        lags[peak_lag_idxs] * compute.BIN_WIDTH_sec,
+        magnitude[peak_lag_idxs, electrode_idxs],
+    )
+
+
+########################################################################################
+#
+# Neural-to-movement latency maps.
+#
+########################################################################################
+
+
+def get_block_latencies(block_data, max_lag_sec=MAX_LAG_sec, chunk_bins=None):
+    """
+    Cross-correlate every electrode's `threshold_crossings` with each of
+    `MOVEMENT_SIGNALS`, with all signals' dimensions correlated in one batch.
+
+    Returns a dict keyed by movement signal, each a dict with the `lags_sec`, the
+    `correlations` (lags x electrodes x 2), and the per-electrode `peak_lag_sec` and
+    `peak_correlation`.
+    """
+    movement_signals = get_movement_signals(block_data)
+    lags, correlations = get_lagged_correlations(
+        block_data["threshold_crossings"],
+        np.concatenate([movement_signals[name] for name in MOVEMENT_SIGNALS], axis=1),
+        max_lag_bins=int(round(max_lag_sec / compute.BIN_WIDTH_sec)),
+        chunk_bins=chunk_bins,
+    )
+
+    latencies = {}
+    dimension_start = 0
+    for name in MOVEMENT_SIGNALS:
+        num_dimensions = movement_signals[name].shape[1]
+        signal_correlations = correlations[
+            :, :, dimension_start : dimension_start + num_dimensions
+        ]
+        dimension_start += num_dimensions
+
+        peak_lag_sec, peak_correlation = get_peak_lags(
+            lags,
+            signal_correlations,
+            get_movement_correlation(movement_signals[name]),
+        )
+        latencies[name] = {
+            "lags_sec": lags * compute.BIN_WIDTH_sec,
+            "correlations": signal_correlations,
+            "peak_lag_sec": peak_lag_sec,
+            "peak_correlation": peak_correlation,
+        }
+
+    return latencies
+
+
+def get_latency_maps(data, **kwargs):
+    """
+    Run `get_block_latencies` on every block. Returns a dict keyed by movement signal,
+    each a dict with `peak_lag_sec` and `peak_correlation` maps of shape
+    (blocks x electrodes).
+    """
+    block_latencies = [get_block_latencies(block_data, **kwargs) for block_data in data]
+
+    return {
+        name: {
+            map_name: np.array(
+                [latencies[name][map_name] for latencies in block_latencies]
+            )
+            for map_name in ["peak_lag_sec", "peak_correlation"]
+        }
+        for name in MOVEMENT_SIGNALS
+    }
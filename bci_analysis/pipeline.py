@@ -0,0 +1,329 @@
+import os
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import partial
+
+from bci_analysis import compute
+from bci_analysis.arrays import ElectrodeIndex
+
+
+########################################################################################
+#
+# Constants.
+#
+########################################################################################
+
+# How many source products (e.g. loaded blocks) `Pipeline.run` computes or holds at
+# once.
+MAX_SOURCES_IN_FLIGHT = 2
+
+
+########################################################################################
+#
+# Pipeline.
+#
+########################################################################################
+
+
+class Pipeline:
+    """
+    A declarative graph of derived data products.
+
+    Each product has a name (any hashable, e.g. `("firing_rates", filepath)`), a
+    function that computes it, and the names of the products it depends on. The
+    function is called with the dependency values as positional arguments, in the
+    declared order.
+
+    `run()` computes only the products needed for the requested targets, computes each
+    of them once, runs independent products concurrently, and drops each intermediate
+    product as soon as every product that depends on it has been computed. Source
+    products are started a few at a time, so intermediates are consumed and dropped
+    before more sources are loaded.
+    """
+
+    def __init__(self):
+        self._functions = {}
+        self._dependencies = {}
+
+    def add_product(self, name, function, dependencies=()):
+        """
+        Declare a product. Declaring the same name twice replaces the earlier one.
+        """
+        self._functions[name] = function
+        self._dependencies[name] = tuple(dependencies)
+
+    def __contains__(self, name):
+        return name in self._functions
+
+    def get_required_products(self, targets):
+        """
+        Get the set of products that must be computed to produce the targets.
+        """
+        required = set()
+        stack = list(targets)
+        while stack:
+            name = stack.pop()
+            if name in required:
+                continue
+            if name not in self._functions:
+                raise KeyError(f"Unknown product: {name!r}")
+            required.add(name)
+            stack.extend(self._dependencies[name])
+
+        return required
+
+    def run(
+        self, targets, max_workers=None, max_sources_in_flight=MAX_SOURCES_IN_FLIGHT
+    ):
+        """
+        Compute the target products and return them as a dict keyed by product name.
+
+        Products run on a thread pool of `max_workers` threads (numpy and scipy release
+        the GIL in their heavy routines). Source products (those without dependencies,
+        e.g. loaded blocks) are the expensive ones to hold, so at most
+        `max_sources_in_flight` of them are computing or held at once, and products
+        whose dependencies are ready run before any new source starts, most recently
+        readied first. Each block is then consumed and released before the next one
+        loads, so peak memory depends on `max_sources_in_flight`, not on the number of
+        blocks.
+        """
+        targets = list(targets)
+        required = self.get_required_products(targets)
+        if max_workers is None:
+            max_workers = min(32, (os.cpu_count() or 1) + 4)
+
+        # Count how many pending consumers each product has, so it can be freed once
+        # all of them are done. Targets hold an extra reference so they are kept.
+        num_consumers = {name: 0 for name in required}
+        dependents = {name: [] for name in required}
+        for name in required:
+            for dependency in self._dependencies[name]:
+                num_consumers[dependency] += 1
+                dependents[dependency].append(name)
+        for name in targets:
+            num_consumers[name] += 1
+
+        num_pending_dependencies = {
+            name: len(set(self._dependencies[name])) for name in required
+        }
+        # Sources in declaration order, and a stack of other products that are ready.
+        sources = deque(
+            name
+            for name in self._functions
+            if name in required and num_pending_dependencies[name] == 0
+        )
+        ready = []
+        live_sources = set()
+        values = {}
+        futures = {}
+
+        def submit(executor, name):
+            args = [values[dependency] for dependency in self._dependencies[name]]
+            futures[executor.submit(self._functions[name], *args)] = name
+
+        def submit_ready(executor):
+            while len(futures) < max_workers:
+                if ready:
+                    submit(executor, ready.pop())
+                elif sources and (
+                    len(live_sources) < max_sources_in_flight or not futures
+                ):
+                    # A source beyond the limit only starts when nothing else can run,
+                    # e.g. when a product depends on more sources than the limit.
+                    name = sources.popleft()
+                    live_sources.add(name)
+                    submit(executor, name)
+                else:
+                    break
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            submit_ready(executor)
+
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = futures.pop(future)
+                    try:
+                        values[name] = future.result()
+                    except BaseException:
+                        for pending_future in futures:
+                            pending_future.cancel()
+                        raise
+
+                    # Release the dependencies this product no longer needs.
+                    for dependency in self._dependencies[name]:
+                        num_consumers[dependency] -= 1
+                        if num_consumers[dependency] == 0:
+                            del values[dependency]
+                            live_sources.discard(dependency)
+
+                    for dependent in set(dependents[name]):
+                        num_pending_dependencies[dependent] -= 1
+                        if num_pending_dependencies[dependent] == 0:
+                            ready.append(dependent)
+
+                # Don't let the finished futures keep their results alive.
+                del future, done
+                submit_ready(executor)
+
+        return {name: values[name] for name in targets}
+
+
+########################################################################################
+#
+# Products for the figure analyses.
+#
+########################################################################################
+
+
+def add_block_products(pipeline, filepath):
+    """
+    Declare the per-block products of one block file: the loaded `block`, its smoothed
+    `firing_rates`, and its `trial_table`.
+    """
+    pipeline.add_product(("block", filepath), partial(compute.load_block, filepath))
+    pipeline.add_product(
+        ("firing_rates", filepath),
+        lambda block_data: compute.get_firing_rates(block_data["threshold_crossings"]),
+        [("block", filepath)],
+    )
+    pipeline.add_product(
+        ("trial_table", filepath), compute.get_trial_table, [("block", filepath)]
+    )
+
+
+def _merge_block_windows(*block_windows):
+    return tuple(
+        compute.merge_grouped(grouped_list) for grouped_list in zip(*block_windows)
+    )
+
+
+def _merge_grouped(*grouped):
+    return compute.merge_grouped(grouped)
+
+
+def _get_trial_averages_of_each(windows_grouped_tuple):
+    return tuple(
+        compute.get_trial_averages(windows_grouped)
+        for windows_grouped in windows_grouped_tuple
+    )
+
+
+def build_figure_pipeline(
+    first_ever_usage_filepaths=compute.FIRST_EVER_USAGE_FILEPATHS,
+    grid_evaluation_filepaths=compute.GRID_EVALUATION_FILEPATHS,
+    simultaneous_filepaths=compute.SIMULTANEOUS_SPEECH_AND_CURSOR_FILEPATHS,
+):
+    """
+    Build a pipeline declaring every product needed by the example figures. Blocks are
+    shared between analyses by filepath, so a block needed by several analyses is
+    loaded, smoothed and windowed only once.
+
+    Analysis products (pass any of these to `Pipeline.run()` as targets):
+    - `figure1_trajectories`: list of `(direction_idx, trial_target, trajectory)`.
+    - `figure1_trial_averages`: `(trial_averaged_by_direction, sem_by_direction)`.
+    - `figure2_grid_results`: list of `get_grid_block_results()` dicts, one per block.
+    - `figure4_acquisition_times`: target acquisition times by condition (ABA blocks).
+    - `figure4_trial_averages`: `(trial_averaged, sem)` pairs aligned to target
+      presentation, cursor go cue and speech go cue, in that order.
+    - `array_label_by_electrode`: the array labels of the first block of any session.
+    - `electrode_index`: an `arrays.ElectrodeIndex` built from those labels.
+    """
+    pipeline = Pipeline()
+
+    all_filepaths = (
+        list(first_ever_usage_filepaths)
+        + list(grid_evaluation_filepaths)
+        + list(simultaneous_filepaths)
+    )
+    for filepath in all_filepaths:
+        if ("block", filepath) not in pipeline:
+            add_block_products(pipeline, filepath)
+
+    ## Figure 1.
+
+    for filepath in first_ever_usage_filepaths:
+        pipeline.add_product(
+            ("radial8_windows", filepath),
+            compute.get_radial8_block_windows,
+            [("trial_table", filepath), ("firing_rates", filepath)],
+        )
+        pipeline.add_product(
+            ("trajectories", filepath),
+            compute.get_center_out_and_back_trajectories,
+            [("block", filepath)],
+        )
+    pipeline.add_product(
+        "figure1_trajectories",
+        lambda *trajectories: [t for block in trajectories for t in block],
+        [("trajectories", filepath) for filepath in first_ever_usage_filepaths],
+    )
+    pipeline.add_product(
+        "figure1_windows_by_direction",
+        _merge_grouped,
+        [("radial8_windows", filepath) for filepath in first_ever_usage_filepaths],
+    )
+    pipeline.add_product(
+        "figure1_trial_averages",
+        compute.get_trial_averages,
+        ["figure1_windows_by_direction"],
+    )
+
+    ## Figure 2.
+
+    for filepath in grid_evaluation_filepaths:
+        pipeline.add_product(
+            ("grid_results", filepath),
+            compute.get_grid_block_results,
+            [("block", filepath)],
+        )
+    pipeline.add_product(
+        "figure2_grid_results",
+        lambda *block_results: list(block_results),
+        [("grid_results", filepath) for filepath in grid_evaluation_filepaths],
+    )
+
+    ## Figure 4.
+
+    for filepath in simultaneous_filepaths:
+        pipeline.add_product(
+            ("simultaneous_windows", filepath),
+            compute.get_simultaneous_block_windows,
+            [("trial_table", filepath), ("firing_rates", filepath)],
+        )
+        pipeline.add_product(
+            ("acquisition_times", filepath),
+            compute.get_block_acquisition_times,
+            [("block", filepath)],
+        )
+    pipeline.add_product(
+        "figure4_acquisition_times",
+        _merge_grouped,
+        [
+            ("acquisition_times", filepath)
+            for filepath in compute.get_ABA_blocks(list(simultaneous_filepaths))
+        ],
+    )
+    pipeline.add_product(
+        "figure4_windows",
+        _merge_block_windows,
+        [("simultaneous_windows", filepath) for filepath in simultaneous_filepaths],
+    )
+    pipeline.add_product(
+        "figure4_trial_averages", _get_trial_averages_of_each, ["figure4_windows"]
+    )
+
+    ## Shared.
+
+    first_filepath = next(iter(all_filepaths), None)
+    if first_filepath is not None:
+        pipeline.add_product(
+            "array_label_by_electrode",
+            lambda block_data: block_data["array_label_by_electrode"],
+            [("block", first_filepath)],
+        )
+        pipeline.add_product(
+            "electrode_index", ElectrodeIndex, ["array_label_by_electrode"]
+        )
+
+    return pipeline
@@ -0,0 +1,226 @@
+import numpy as np
+
+
+########################################################################################
+#
+# Constants.
+#
+########################################################################################
+
+NUM_COMPONENTS = 10
+
+
+########################################################################################
+#
+# Condition-averaged matrices.
+#
+########################################################################################
+
+
+def get_condition_average_matrix(
+    trial_averaged_by_condition, remove_condition_mean=True
+):
+    """
+    Stack trial averages (each bins x electrodes, e.g. the output of
+    `compute.get_trial_averages`) into one (conditions * bins) x electrodes matrix.
+    Conditions with no trials (all-NaN averages) are skipped.
+
+    With `remove_condition_mean`, the average across conditions at each bin is
+    subtracted first, so that only condition-dependent activity remains.
+    """
+    averages = np.array(
+        [
+            trial_averaged
+            for trial_averaged in trial_averaged_by_condition.values()
+            if np.all(np.isfinite(trial_averaged))
+        ]
+    )
+    if remove_condition_mean:
+        averages = averages - averages.mean(axis=0, keepdims=True)
+
+    return averages.reshape(-1, averages.shape[-1])
+
+
+class CovarianceAccumulator:
+    """
+    Running mean and covariance of rows (samples x electrodes) that are fed in chunks,
+    e.g. one block or one session at a time, so the full matrix never has to be built.
+    Accumulators from different workers can be combined with `merge()`.
+
+    For example, feed each block's `get_condition_average_matrix` into `update()` and
+    pass the accumulator to `fit_pca` to get population components over all sessions.
+    """
+
+    def __init__(self, num_electrodes):
+        self.count = 0
+        self.sum = np.zeros(num_electrodes)
+        self.sum_of_outer_products = np.zeros((num_electrodes, num_electrodes))
+
+    def update(self, rows):
+        rows = np.asarray(rows, dtype=np.float64).reshape(-1, len(self.sum))
+        self.count += len(rows)
+        self.sum += rows.sum(axis=0)
+        self.sum_of_outer_products += rows.T @ rows
+
+    def merge(self, other):
+        self.count += other.count
+        self.sum += other.sum
+        self.sum_of_outer_products += other.sum_of_outer_products
+
+    @property
+    def mean(self):
+        return self.sum / self.count
+
+    @property
+    def covariance(self):
+        mean = self.mean
+        return self.sum_of_outer_products / self.count - np.outer(mean, mean)
+
+
+########################################################################################
+#
+# PCA.
+#
+########################################################################################
+
+
+def randomized_svd(matrix, rank, num_oversamples=10, num_power_iterations=4, seed=0):
+    """
+    Truncated SVD of `matrix` by randomized range finding (Halko, Martinsson & Tropp,
+    2011). Returns `(U, S, Vt)` with `rank` components.
+    """
+    rng = np.random.default_rng(seed)
+    num_rows, num_columns = matrix.shape
+    num_samples = min(rank + num_oversamples, num_rows, num_columns)
+
+    # Find an orthonormal basis for the range of the matrix, sharpened by a few power
+    # iterations (with re-orthonormalization for numerical stability).
+    basis, _ = np.linalg.qr(matrix @ rng.standard_normal((num_columns, num_samples)))
+    for _ in range(num_power_iterations):
+        basis, _ = np.linalg.qr(matrix.T @ basis)
+        basis, _ = np.linalg.qr(matrix @ basis)
+
+    small_u, singular_values, vt = np.linalg.svd(basis.T @ matrix, full_matrices=False)
+    u = basis @ small_u
+
+    return u[:, :rank], singular_values[:rank], vt[:rank]
+
+
+def fit_pca(data, num_components=NUM_COMPONENTS, seed=0):
+    """
+    Fit PCA either to a samples x electrodes matrix (with a randomized SVD) or to a
+    `CovarianceAccumulator` (with an eigendecomposition of its covariance).
+
+    Returns a dict with the `mean` (electrodes), `components` (components x
+    electrodes, orthonormal rows), `explained_variance` (components) and
+    `explained_variance_ratio` (components).
+    """
+    if isinstance(data, CovarianceAccumulator):
+        mean = data.mean
+        covariance = data.covariance
+        total_variance = np.trace(covariance)
+        eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+        order = np.argsort(eigenvalues)[::-1][:num_components]
+        explained_variance = np.clip(eigenvalues[order], 0, None)
+        components = eigenvectors[:, order].T
+    else:
+        data = np.asarray(data, dtype=np.float64)
+        mean = data.mean(axis=0)
+        centered = data - mean
+        total_variance = np.sum(centered**2) / len(data)
+        _, singular_values, components = randomized_svd(
+            centered, num_components, seed=seed
+        )
+        explained_variance = singular_values**2 / len(data)
+
+    return {
+        "mean": mean,
+        "components": components,
+        "explained_variance": explained_variance,
+        "explained_variance_ratio": explained_variance / total_variance,
+    }
+
+
+def project(neural_data, pca):
+    """
+    Project neural data (..., electrodes), e.g. aligned trials (trials x bins x
+    electrodes), into the low-dimensional state space of a PCA fit. Returns
+    (..., components).
+    """
+    return (np.asarray(neural_data) - pca["mean"]) @ pca["components"].T
+
+
+def get_variance_captured(data, components):
+    """
+    Fraction of the total variance of `data` (samples x electrodes) captured by the
+    subspace spanned by the orthonormal rows of `components`.
+    """
+    centered = data - data.mean(axis=0)
+    captured = np.sum((centered @ components.T) ** 2)
+
+    return captured / np.sum(centered**2)
+
+
+def get_principal_angles(components, other_components):
+    """
+    Principal angles (radians, ascending) between two subspaces given by orthonormal
+    rows.
+    """
+    cosines = np.linalg.svd(components @ other_components.T, compute_uv=False)
+
+    return np.arccos(np.clip(cosines, -1.0, 1.0))
+
+
+########################################################################################
+#
+# Cursor-direction vs speech-prompt subspaces.
+#
+########################################################################################
+
+
+def get_direction_and_prompt_subspaces(
+    trial_averaged_by_direction,
+    trial_averaged_by_prompt,
+    num_components=NUM_COMPONENTS,
+    seed=0,
+):
+    """
+    Find the neural subspaces of cursor-direction and speech-prompt activity, e.g. from
+    trial averages aligned to the cursor go cue (by direction) and to the speech go cue
+    (by prompt), and compare them.
+
+    Returns a dict with:
+    - `direction_pca`, `prompt_pca`: `fit_pca` results on each condition-average matrix.
+    - `variance_captured`: dict keyed by `(data, subspace)`, each one of `"direction"`
+      or `"prompt"`, of the fraction of that data's variance captured by that subspace.
+    - `principal_angles`: between the two subspaces.
+    - `subspace_overlap`: mean squared cosine of the principal angles (1 when the
+      subspaces are identical, 0 when they are orthogonal).
+    """
+    matrices = {
+        "direction": get_condition_average_matrix(trial_averaged_by_direction),
+        "prompt": get_condition_average_matrix(trial_averaged_by_prompt),
+    }
+    pcas = {
+        name: fit_pca(matrix, num_components=num_components, seed=seed)
+        for name, matrix in matrices.items()
+    }
+
+    variance_captured = {
+        (data_name, subspace_name): get_variance_captured(
+            matrix, pcas[subspace_name]["components"]
+        )
+        for data_name, matrix in matrices.items()
+        for subspace_name in pcas
+    }
+    principal_angles = get_principal_angles(
+        pcas["direction"]["components"], pcas["prompt"]["components"]
+    )
+
+    return {
+        "direction_pca": pcas["direction"],
+        "prompt_pca": pcas["prompt"],
+        "variance_captured": variance_captured,
+        "principal_angles": principal_angles,
+        "subspace_overlap": np.mean(np.cos(principal_angles) ** 2),
+    }
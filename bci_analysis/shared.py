@@ -0,0 +1,265 @@
+import os
+import shutil
+import tempfile
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from bci_analysis import compute
+
+
+########################################################################################
+#
+# Shared block.
+#
+########################################################################################
+
+
+class SharedBlock:
+    """
+    Per-bin arrays of a block (e.g., `threshold_crossings`, `spike_band_power`,
+    `firing_rates`) placed in named shared memory, or in memory-mapped `.npy` files, so
+    that worker processes can attach to them by name without copying or pickling.
+
+    The process that creates a SharedBlock owns the underlying memory and frees it in
+    `close()` (or when leaving a `with` block). Workers receive only `spec`, a small
+    picklable description of where each array lives, and open it with
+    `attach_shared_arrays(spec)`.
+    """
+
+    def __init__(self, arrays, backend="shared_memory", memmap_dir=None):
+        """
+        `arrays` is a dict of name to array. `backend` is `"shared_memory"` (POSIX or
+        Windows named shared memory) or `"memmap"` (`.npy` files in `memmap_dir`, or in
+        a new temporary directory if it is None).
+        """
+        if backend not in ("shared_memory", "memmap"):
+            raise ValueError(f"Unknown backend: {backend!r}")
+
+        self.backend = backend
+        self.spec = {}
+        self._shared_memories = []
+        self._memmap_dir = None
+        self._owns_memmap_dir = False
+        self.arrays = {}
+
+        if backend == "memmap":
+            if memmap_dir is None:
+                memmap_dir = tempfile.mkdtemp(prefix="bci_shared_block_")
+                self._owns_memmap_dir = True
+            self._memmap_dir = memmap_dir
+
+        try:
+            for name, array in arrays.items():
+                self._add_array(name, np.ascontiguousarray(array))
+        except BaseException:
+            self.close()
+            raise
+
+    @classmethod
+    def from_block(
+        cls,
+        block_data,
+        fields=("threshold_crossings", "spike_band_power"),
+        include_firing_rates=True,
+        **kwargs,
+    ):
+        """
+        Share the per-bin neural fields of a loaded block, plus the smoothed
+        `firing_rates` derived from `threshold_crossings`.
+        """
+        arrays = {field: block_data[field] for field in fields}
+        if include_firing_rates:
+            arrays["firing_rates"] = compute.get_firing_rates(
+                block_data["threshold_crossings"]
+            )
+
+        return cls(arrays, **kwargs)
+
+    def _add_array(self, name, array):
+        if self.backend == "shared_memory":
+            shared_memory_block = shared_memory.SharedMemory(
+                create=True, size=max(array.nbytes, 1)
+            )
+            self._shared_memories.append(shared_memory_block)
+            shared_array = np.ndarray(
+                array.shape, dtype=array.dtype, buffer=shared_memory_block.buf
+            )
+            location = shared_memory_block.name
+        else:
+            location = os.path.join(self._memmap_dir, f"{name}_{uuid.uuid4().hex}.npy")
+            shared_array = np.lib.format.open_memmap(
+                location, mode="w+", dtype=array.dtype, shape=array.shape
+            )
+
+        shared_array[...] = array
+        self.arrays[name] = shared_array
+        self.spec[name] = (self.backend, location, array.shape, array.dtype.str)
+
+    def close(self):
+        """
+        Release and delete the shared memory (or memory-mapped files). Arrays obtained
+        from this block must not be used afterwards.
+        """
+        self.arrays = {}
+        for shared_memory_block in self._shared_memories:
+            try:
+                shared_memory_block.close()
+            except BufferError:
+                # Arrays still referenced elsewhere keep the mapping alive until they
+                # are garbage collected; the name is unlinked regardless.
+                pass
+            try:
+                shared_memory_block.unlink()
+            except FileNotFoundError:
+                pass
+        self._shared_memories = []
+
+        if self._memmap_dir is not None:
+            for _, location, _, _ in self.spec.values():
+                if os.path.exists(location):
+                    os.remove(location)
+            if self._owns_memmap_dir:
+                shutil.rmtree(self._memmap_dir, ignore_errors=True)
+            self._memmap_dir = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+########################################################################################
+#
+# Worker side.
+#
+########################################################################################
+
+# How many SharedBlocks' memory a process keeps attached. Attaching a further block
+# detaches the least recently used one, so a long-lived worker doesn't keep the memory
+# of every block it has seen mapped (and unfreeable) for its whole lifetime.
+MAX_ATTACHED_SPECS = 4
+
+# Shared memory attached by this process, keyed by the spec it was attached for, and
+# kept open so repeated tasks in the same worker reuse the mapping instead of
+# reattaching. Ordered from least to most recently used.
+_attached_shared_memories = OrderedDict()
+
+
+def _get_spec_key(spec):
+    return tuple(
+        location
+        for backend, location, _, _ in spec.values()
+        if backend == "shared_memory"
+    )
+
+
+def _open_shared_memory(name):
+    try:
+        # Python 3.13+: don't let this process's resource tracker unlink memory owned
+        # by the parent.
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+def _close_shared_memories(shared_memory_blocks):
+    for shared_memory_block in shared_memory_blocks.values():
+        try:
+            shared_memory_block.close()
+        except BufferError:
+            # Arrays still referenced elsewhere keep the mapping alive until they are
+            # garbage collected.
+            pass
+
+
+def _get_attached_shared_memories(spec):
+    key = _get_spec_key(spec)
+    if key in _attached_shared_memories:
+        _attached_shared_memories.move_to_end(key)
+        return _attached_shared_memories[key]
+
+    while len(_attached_shared_memories) >= MAX_ATTACHED_SPECS:
+        _, shared_memory_blocks = _attached_shared_memories.popitem(last=False)
+        _close_shared_memories(shared_memory_blocks)
+
+    shared_memory_blocks = {name: _open_shared_memory(name) for name in key}
+    _attached_shared_memories[key] = shared_memory_blocks
+
+    return shared_memory_blocks
+
+
+def attach_shared_arrays(spec):
+    """
+    Open the arrays described by `SharedBlock.spec` without copying them. Returns a dict
+    of read-only arrays.
+
+    Shared memory stays attached for later calls with the same spec, for up to
+    `MAX_ATTACHED_SPECS` specs; call `detach_shared_arrays(spec)` once a block is done
+    with to release it sooner.
+    """
+    shared_memory_blocks = _get_attached_shared_memories(spec)
+
+    arrays = {}
+    for name, (backend, location, shape, dtype) in spec.items():
+        if backend == "shared_memory":
+            array = np.ndarray(
+                shape, dtype=dtype, buffer=shared_memory_blocks[location].buf
+            )
+        else:
+            array = np.load(location, mmap_mode="r")
+        array.flags.writeable = False
+        arrays[name] = array
+
+    return arrays
+
+
+def detach_shared_arrays(spec):
+    """
+    Detach this process from the shared memory attached by `attach_shared_arrays(spec)`,
+    so it can be freed once the owner closes the SharedBlock. Arrays from that spec must
+    not be used afterwards.
+    """
+    shared_memory_blocks = _attached_shared_memories.pop(_get_spec_key(spec), None)
+    if shared_memory_blocks is not None:
+        _close_shared_memories(shared_memory_blocks)
+
+
+def _call_with_attached_arrays(function, spec, electrode_idxs, kwargs):
+    return function(attach_shared_arrays(spec), electrode_idxs, **kwargs)
+
+
+def map_electrode_chunks(
+    function, shared_block, num_chunks=None, max_workers=None, **kwargs
+):
+    """
+    Run `function(arrays, electrode_idxs, **kwargs)` over chunks of electrodes on a
+    process pool, where `arrays` are the block's arrays attached zero-copy in each
+    worker. `function` must be importable (defined at module level). Returns the list
+    of results in electrode order.
+    """
+    num_electrodes = next(iter(shared_block.spec.values()))[2][1]
+    if num_chunks is None:
+        num_chunks = max_workers or os.cpu_count() or 1
+    electrode_chunks = [
+        chunk
+        for chunk in np.array_split(np.arange(num_electrodes), num_chunks)
+        if len(chunk)
+    ]
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(
+                _call_with_attached_arrays,
+                function,
+                shared_block.spec,
+                electrode_idxs,
+                kwargs,
+            )
+            for electrode_idxs in electrode_chunks
+        ]
+        return [future.result() for future in futures]
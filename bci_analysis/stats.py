@@ -0,0 +1,240 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+
+########################################################################################
+#
+# Constants.
+#
+########################################################################################
+
+NUM_RESAMPLES = 10000
+CONFIDENCE_LEVEL = 0.95
+
+# Resamples are drawn in shards of this size, each from its own child seed. The shard
+# size (not the number of workers) fixes the random streams, so results for a given
+# seed are identical whether shards run in this process or on a process pool.
+RESAMPLES_PER_SHARD = 2000
+
+# Condition comparisons for target acquisition times in the Simultaneous Speech and
+# Cursor Task, as `(condition, reference_condition)` keys of
+# `compute.get_acquisition_times_by_condition`.
+ACQUISITION_TIME_COMPARISONS = [
+    ("verbal_beep", "verbal_nobeep"),
+    ("control_beep", "control_nobeep"),
+    ("verbal_beep", "control_beep"),
+    ("verbal_nobeep", "control_nobeep"),
+]
+
+_STATISTICS = {"median": np.median, "mean": np.mean}
+
+
+########################################################################################
+#
+# Shards.
+#
+########################################################################################
+
+
+def _get_statistic(statistic):
+    if statistic not in _STATISTICS:
+        raise ValueError(f"Unknown statistic: {statistic!r}")
+
+    return _STATISTICS[statistic]
+
+
+def _get_shard_sizes(num_resamples, resamples_per_shard):
+    num_full_shards, remainder = divmod(num_resamples, resamples_per_shard)
+    shard_sizes = [resamples_per_shard] * num_full_shards
+    if remainder:
+        shard_sizes.append(remainder)
+
+    return shard_sizes
+
+
+def _bootstrap_shard(values, reference_values, statistic, num_resamples, seed):
+    # Resample both conditions with one batched index matrix each.
+    statistic_function = _get_statistic(statistic)
+    rng = np.random.default_rng(seed)
+    resample_idxs = rng.integers(0, len(values), size=(num_resamples, len(values)))
+    reference_resample_idxs = rng.integers(
+        0, len(reference_values), size=(num_resamples, len(reference_values))
+    )
+
+    return statistic_function(values[resample_idxs], axis=1) - statistic_function(
+        reference_values[reference_resample_idxs], axis=1
+    )
+
+
+def _permutation_shard(pooled_values, num_values, statistic, num_resamples, seed):
+    # Shuffle the condition labels of all resamples at once by permuting each row of an
+    # index matrix.
+    statistic_function = _get_statistic(statistic)
+    rng = np.random.default_rng(seed)
+    permuted_idxs = rng.permuted(
+        np.broadcast_to(
+            np.arange(len(pooled_values)), (num_resamples, len(pooled_values))
+        ),
+        axis=1,
+    )
+    permuted_values = pooled_values[permuted_idxs]
+
+    return statistic_function(
+        permuted_values[:, :num_values], axis=1
+    ) - statistic_function(permuted_values[:, num_values:], axis=1)
+
+
+def _run_shards(shard_function, args, num_resamples, seed, max_workers):
+    shard_sizes = _get_shard_sizes(num_resamples, RESAMPLES_PER_SHARD)
+    shard_seeds = np.random.SeedSequence(seed).spawn(len(shard_sizes))
+
+    if max_workers is None or max_workers <= 1:
+        shard_results = [
+            shard_function(*args, shard_size, shard_seed)
+            for shard_size, shard_seed in zip(shard_sizes, shard_seeds)
+        ]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(shard_function, *args, shard_size, shard_seed)
+                for shard_size, shard_seed in zip(shard_sizes, shard_seeds)
+            ]
+            shard_results = [future.result() for future in futures]
+
+    return np.concatenate(shard_results + [np.zeros(0)])
+
+
+########################################################################################
+#
+# Bootstrap and permutation tests.
+#
+########################################################################################
+
+
+def bootstrap_difference(
+    values,
+    reference_values,
+    statistic="median",
+    num_resamples=NUM_RESAMPLES,
+    confidence_level=CONFIDENCE_LEVEL,
+    seed=0,
+    max_workers=None,
+):
+    """
+    Bootstrap the difference in `statistic` (`"median"` or `"mean"`) between two
+    conditions, `statistic(values) - statistic(reference_values)`.
+
+    Returns a dict with the observed `difference`, its percentile confidence interval
+    `ci` (lower, upper), and the `bootstrap_differences` themselves. With `max_workers`
+    greater than 1, shards of resamples run on a process pool.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    reference_values = np.asarray(reference_values, dtype=np.float64)
+    statistic_function = _get_statistic(statistic)
+
+    difference = statistic_function(values) - statistic_function(reference_values)
+    bootstrap_differences = _run_shards(
+        _bootstrap_shard,
+        (values, reference_values, statistic),
+        num_resamples,
+        seed,
+        max_workers,
+    )
+    percentiles = 100 * np.array([1 - confidence_level, 1 + confidence_level]) / 2
+
+    return {
+        "difference": difference,
+        "ci": np.percentile(bootstrap_differences, percentiles),
+        "bootstrap_differences": bootstrap_differences,
+    }
+
+
+def permutation_test(
+    values,
+    reference_values,
+    statistic="median",
+    num_permutations=NUM_RESAMPLES,
+    alternative="two-sided",
+    seed=0,
+    max_workers=None,
+):
+    """
+    Permutation test of the difference in `statistic` (`"median"` or `"mean"`) between
+    two conditions, shuffling condition labels across the pooled values.
+
+    `alternative` is `"two-sided"`, `"greater"` (values tend to be larger than the
+    reference) or `"less"`. Returns a dict with the observed `difference`, the `p_value`
+    (with the +1 correction, so it is never 0), and the `null_differences`.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    reference_values = np.asarray(reference_values, dtype=np.float64)
+    statistic_function = _get_statistic(statistic)
+
+    difference = statistic_function(values) - statistic_function(reference_values)
+    null_differences = _run_shards(
+        _permutation_shard,
+        (np.concatenate([values, reference_values]), len(values), statistic),
+        num_permutations,
+        seed,
+        max_workers,
+    )
+
+    if alternative == "two-sided":
+        num_extreme = np.sum(np.abs(null_differences) >= np.abs(difference))
+    elif alternative == "greater":
+        num_extreme = np.sum(null_differences >= difference)
+    elif alternative == "less":
+        num_extreme = np.sum(null_differences <= difference)
+    else:
+        raise ValueError(f"Unknown alternative: {alternative!r}")
+
+    return {
+        "difference": difference,
+        "p_value": (num_extreme + 1) / (len(null_differences) + 1),
+        "null_differences": null_differences,
+    }
+
+
+def compare_conditions(
+    values_by_condition,
+    comparisons=ACQUISITION_TIME_COMPARISONS,
+    statistic="median",
+    num_resamples=NUM_RESAMPLES,
+    seed=0,
+    max_workers=None,
+):
+    """
+    Run `bootstrap_difference` and `permutation_test` for each
+    `(condition, reference_condition)` pair, e.g. on the output of
+    `compute.get_acquisition_times_by_condition`. Returns a dict keyed by the pair, with
+    the `difference`, bootstrap `ci` and permutation `p_value`.
+    """
+    results = {}
+    for condition, reference_condition in comparisons:
+        values = values_by_condition[condition]
+        reference_values = values_by_condition[reference_condition]
+
+        bootstrap = bootstrap_difference(
+            values,
+            reference_values,
+            statistic=statistic,
+            num_resamples=num_resamples,
+            seed=seed,
+            max_workers=max_workers,
+        )
+        permutation = permutation_test(
+            values,
+            reference_values,
+            statistic=statistic,
+            num_permutations=num_resamples,
+            seed=seed,
+            max_workers=max_workers,
+        )
+        results[(condition, reference_condition)] = {
+            "difference": bootstrap["difference"],
+            "ci": bootstrap["ci"],
+            "p_value": permutation["p_value"],
+        }
+
+    return results
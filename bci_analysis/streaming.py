@@ -0,0 +1,297 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from bci_analysis import compute
+
+
+########################################################################################
+#
+# Constants.
+#
+########################################################################################
+
+# How many blocks each stage may hold (submitted or finished but not yet taken by the
+# next stage). Peak memory is roughly this many blocks per stage, independent of how
+# many blocks are streamed.
+MAX_IN_FLIGHT = 2
+
+
+########################################################################################
+#
+# Running statistics.
+#
+########################################################################################
+
+
+class RunningMoments:
+    """
+    Running count, mean and sum of squared deviations of samples that arrive in
+    batches (stacked along the first axis), merged with Chan et al.'s parallel update
+    so each batch is folded in with vectorized operations. Instances built from
+    different parts of the data can be combined with `merge()`.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = None
+        self.sum_of_squared_deviations = None
+
+    def update(self, samples):
+        samples = np.asarray(samples, dtype=np.float64)
+        batch = RunningMoments()
+        batch.count = len(samples)
+        if batch.count > 0:
+            batch.mean = samples.mean(axis=0)
+            batch.sum_of_squared_deviations = np.sum(
+                (samples - batch.mean) ** 2, axis=0
+            )
+        else:
+            batch.mean = np.zeros(samples.shape[1:])
+            batch.sum_of_squared_deviations = np.zeros(samples.shape[1:])
+        self.merge(batch)
+
+    def merge(self, other):
+        if other.mean is None:
+            return
+        if self.mean is None:
+            self.count = other.count
+            self.mean = other.mean.copy()
+            self.sum_of_squared_deviations = other.sum_of_squared_deviations.copy()
+            return
+
+        total_count = self.count + other.count
+        if total_count == 0:
+            return
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * (other.count / total_count)
+        self.sum_of_squared_deviations = (
+            self.sum_of_squared_deviations
+            + other.sum_of_squared_deviations
+            + delta**2 * (self.count * other.count / total_count)
+        )
+        self.count = total_count
+
+    @property
+    def variance(self):
+        """
+        Population variance (ddof=0), NaN before any samples.
+        """
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return self.sum_of_squared_deviations / self.count
+
+    def get_mean(self):
+        """
+        The mean, NaN before any samples.
+        """
+        if self.count == 0:
+            return np.full_like(self.mean, np.nan)
+
+        return self.mean
+
+
+class TrialAverageAccumulator:
+    """
+    Fold grouped windows (dicts of trials x bins x electrodes arrays, e.g. from
+    `compute.group_windows`), one block at a time, into per-key running moments, so the
+    trial averages are available without keeping every window in memory.
+    """
+
+    def __init__(self):
+        self.moments_by_key = {}
+
+    def update(self, windows_grouped):
+        for key, windows in windows_grouped.items():
+            self.moments_by_key.setdefault(key, RunningMoments()).update(windows)
+
+    def get_trial_averages(self):
+        """
+        Trial averages and standard errors of the mean, as two dicts, matching
+        `compute.get_trial_averages` on the same windows.
+        """
+        trial_averaged = {
+            key: moments.get_mean() for key, moments in self.moments_by_key.items()
+        }
+        sem = {
+            key: np.sqrt(moments.variance) / np.sqrt(moments.count)
+            for key, moments in self.moments_by_key.items()
+        }
+
+        return trial_averaged, sem
+
+
+########################################################################################
+#
+# Streaming stages.
+#
+########################################################################################
+
+
+def bounded_map(function, items, max_in_flight=MAX_IN_FLIGHT, executor=None):
+    """
+    Lazily apply `function` to each item of the iterable `items`, yielding results in
+    order. With an `executor`, up to `max_in_flight` items are processed ahead of the
+    consumer, and no more items are taken from `items` until the consumer takes a
+    result (backpressure), so chained stages never hold more than their limit.
+    """
+    if executor is None:
+        for item in items:
+            yield function(item)
+        return
+
+    pending = deque()
+    try:
+        for item in items:
+            pending.append(executor.submit(function, item))
+            del item
+            if len(pending) >= max_in_flight:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def get_block_features(block_data):
+    """
+    The features most analyses need from a block: its `trial_table` and smoothed
+    `firing_rates`. The block itself is not kept, so it can be released.
+    """
+    return {
+        "trial_table": compute.get_trial_table(block_data),
+        "firing_rates": compute.get_firing_rates(block_data["threshold_crossings"]),
+    }
+
+
+def stream_analysis(
+    filepaths,
+    accumulate,
+    feature_function=get_block_features,
+    align_function=None,
+    max_in_flight=MAX_IN_FLIGHT,
+    max_workers=None,
+):
+    """
+    Stream blocks through load -> feature -> align -> accumulate stages.
+
+    Blocks are loaded and passed through `feature_function` (block -> features) and
+    `align_function` (features -> per-block result, skipped if None) on a thread pool,
+    with each stage bounded by `max_in_flight`. `accumulate` is called with each
+    per-block result in file order, and should fold it into running aggregates; after
+    that nothing refers to the block, so it is freed.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        blocks = bounded_map(compute.load_block, filepaths, max_in_flight, executor)
+        block_results = bounded_map(feature_function, blocks, max_in_flight, executor)
+        if align_function is not None:
+            block_results = bounded_map(
+                align_function, block_results, max_in_flight, executor
+            )
+
+        for block_result in block_results:
+            accumulate(block_result)
+            del block_result
+
+
+########################################################################################
+#
+# Streamed figure analyses.
+#
+########################################################################################
+
+
+def _get_radial8_block_windows(features):
+    return compute.get_radial8_block_windows(
+        features["trial_table"], features["firing_rates"]
+    )
+
+
+def _get_simultaneous_block_windows(features):
+    return compute.get_simultaneous_block_windows(
+        features["trial_table"], features["firing_rates"]
+    )
+
+
+def stream_radial8_trial_averages(
+    filepaths=compute.FIRST_EVER_USAGE_FILEPATHS, **kwargs
+):
+    """
+    Like `compute.get_trial_averages(compute.get_radial8_windows_by_direction(data))`,
+    but streaming the blocks instead of loading them all. `kwargs` are passed to
+    `stream_analysis`.
+    """
+    accumulator = TrialAverageAccumulator()
+    stream_analysis(
+        filepaths,
+        accumulator.update,
+        align_function=_get_radial8_block_windows,
+        **kwargs,
+    )
+
+    return accumulator.get_trial_averages()
+
+
+def stream_simultaneous_trial_averages(
+    filepaths=compute.SIMULTANEOUS_SPEECH_AND_CURSOR_FILEPATHS, **kwargs
+):
+    """
+    Trial averages of Simultaneous Speech and Cursor Task windows, streaming the blocks.
+    Returns `(trial_averaged, sem)` pairs aligned to target presentation, cursor go cue
+    and speech go cue, in that order.
+    """
+    accumulators = [TrialAverageAccumulator() for _ in range(3)]
+
+    def accumulate(block_windows):
+        for accumulator, windows_grouped in zip(accumulators, block_windows):
+            accumulator.update(windows_grouped)
+
+    stream_analysis(
+        filepaths,
+        accumulate,
+        align_function=_get_simultaneous_block_windows,
+        **kwargs,
+    )
+
+    return tuple(accumulator.get_trial_averages() for accumulator in accumulators)
+
+
+def stream_acquisition_times(
+    filepaths=compute.get_ABA_blocks(compute.SIMULTANEOUS_SPEECH_AND_CURSOR_FILEPATHS),
+    **kwargs,
+):
+    """
+    Like `compute.get_acquisition_times_by_condition(data)`, but streaming the blocks.
+    The default filepaths are the ABA subset used in figure 4.
+    """
+    acquisition_times_by_condition = {}
+
+    def accumulate(block_acquisition_times):
+        for condition, times in block_acquisition_times.items():
+            acquisition_times_by_condition.setdefault(condition, []).extend(times)
+
+    stream_analysis(
+        filepaths,
+        accumulate,
+        feature_function=compute.get_block_acquisition_times,
+        **kwargs,
+    )
+
+    return acquisition_times_by_condition
+
+
+def stream_grid_results(filepaths=compute.GRID_EVALUATION_FILEPATHS, **kwargs):
+    """
+    Like `[compute.get_grid_block_results(block_data) for block_data in data]`, but
+    streaming the blocks.
+    """
+    grid_results = []
+    stream_analysis(
+        filepaths,
+        grid_results.append,
+        feature_function=compute.get_grid_block_results,
+        **kwargs,
+    )
+
+    return grid_results
@@ -0,0 +1,296 @@
+import numpy as np
+
+from bci_analysis import compute
+
+
+########################################################################################
+#
+# Constants.
+#
+########################################################################################
+
+# Window (relative to the trial's go cue) over which firing rates are averaged for each
+# trial before fitting tuning curves.
+TUNING_WINDOW_START_sec = 0.0
+TUNING_WINDOW_END_sec = 0.5
+
+NUM_BOOTSTRAP_RESAMPLES = 1000
+CONFIDENCE_LEVEL = 0.95
+
+# Sessions whose blocks are used to track tuning across days.
+TUNING_SESSION_FILEPATHS = {
+    39: compute.FIRST_EVER_USAGE_FILEPATHS,
+    202: compute.SIMULTANEOUS_SPEECH_AND_CURSOR_FILEPATHS,
+    468: compute.GRID_EVALUATION_FILEPATHS,
+}
+
+
+########################################################################################
+#
+# Trial data.
+#
+########################################################################################
+
+
+def get_block_tuning_trials(block_data, firing_rates=None):
+    """
+    Get each trial's mean firing rate per electrode (trials x electrodes) in the tuning
+    window after the go cue, and the angle (in radians) of the vector from the cursor to
+    the cued target at the go cue.
+
+    The go cue is `cursor_go_cue_bin` in Simultaneous Speech and Cursor Task blocks
+    (where trials with a beep are skipped, so speech doesn't contaminate the fit) and
+    `trial_start_bin` otherwise. Trials where the cursor is already on the target
+    center are skipped, as are trials whose window goes outside the block.
+    """
+    if firing_rates is None:
+        firing_rates = compute.get_firing_rates(block_data["threshold_crossings"])
+
+    trial_table = compute.get_trial_table(block_data)
+    if "cursor_go_cue_bin" in trial_table:
+        go_cue_bins = trial_table["cursor_go_cue_bin"]
+        is_kept = ~trial_table["is_beep_trial"]
+    else:
+        go_cue_bins = trial_table["trial_start_bin"]
+        is_kept = np.ones(len(go_cue_bins), dtype=bool)
+
+    movement_vectors = (
+        block_data["target_position"][go_cue_bins]
+        - block_data["cursor_position"][go_cue_bins]
+    )
+    is_kept &= np.any(movement_vectors != 0, axis=1)
+
+    window_start_bins = int(round(TUNING_WINDOW_START_sec / compute.BIN_WIDTH_sec))
+    window_end_bins = int(round(TUNING_WINDOW_END_sec / compute.BIN_WIDTH_sec))
+    aligned_by_event, trial_idxs_by_event = compute.align_to_events(
+        firing_rates,
+        {"go_cue": go_cue_bins},
+        {"go_cue": is_kept},
+        pre_bins=-window_start_bins,
+        post_bins=window_end_bins,
+    )
+
+    trial_rates = aligned_by_event["go_cue"].mean(axis=1)
+    kept_vectors = movement_vectors[trial_idxs_by_event["go_cue"]]
+    trial_angles = np.arctan2(kept_vectors[:, 1], kept_vectors[:, 0])
+
+    return trial_rates, trial_angles
+
+
+def get_session_tuning_trials(data):
+    """
+    Concatenate `get_block_tuning_trials` over all the blocks of a session.
+    """
+    block_trials = [get_block_tuning_trials(block_data) for block_data in data]
+    trial_rates = np.concatenate([rates for rates, _ in block_trials])
+    trial_angles = np.concatenate([angles for _, angles in block_trials])
+
+    return trial_rates, trial_angles
+
+
+########################################################################################
+#
+# Cosine tuning.
+#
+########################################################################################
+
+
+def get_design_matrix(trial_angles):
+    """
+    Cosine tuning design matrix (trials x 3) of each trial's baseline, cosine and sine
+    terms.
+    """
+    return np.column_stack(
+        [np.ones(len(trial_angles)), np.cos(trial_angles), np.sin(trial_angles)]
+    )
+
+
+def _get_tuning_parameters(coefficients):
+    # coefficients: (..., 3, electrodes) of baseline, cosine and sine weights.
+    baseline = coefficients[..., 0, :]
+    preferred_direction = np.arctan2(coefficients[..., 2, :], coefficients[..., 1, :])
+    modulation_depth = np.hypot(coefficients[..., 1, :], coefficients[..., 2, :])
+
+    return baseline, preferred_direction, modulation_depth
+
+
+def _get_bootstrap_counts(rng, num_resamples, num_trials):
+    # One batched index matrix of resampled trials, turned into how many times each
+    # trial is drawn in each resample.
+    resample_idxs = rng.integers(0, num_trials, size=(num_resamples, num_trials))
+    flat_idxs = resample_idxs + num_trials * np.arange(num_resamples)[:, np.newaxis]
+    counts = np.bincount(flat_idxs.ravel(), minlength=num_resamples * num_trials)
+
+    return counts.reshape(num_resamples, num_trials).astype(np.float64)
+
+
+def _fit_weighted(design_matrix, trial_rates, weights):
+    """
+    Weighted least squares for a batch of weight vectors at once. `weights` has shape
+    (resamples x trials). Returns coefficients (resamples x 3 x electrodes) and R^2
+    (resamples x electrodes).
+    """
+    weighted_design = weights[:, :, np.newaxis] * design_matrix
+    xtwx = np.einsum("bni,nj->bij", weighted_design, design_matrix)
+    xtwy = np.einsum("bni,ne->bie", weighted_design, trial_rates)
+    coefficients = np.linalg.solve(xtwx, xtwy)
+
+    # Residual and total sums of squares, expanded so they only need the weighted
+    # moments above instead of the full (resamples x trials x electrodes) residuals.
+    ywy = weights @ (trial_rates**2)
+    ss_residual = (
+        ywy
+        - 2 * np.einsum("bie,bie->be", coefficients, xtwy)
+        + np.einsum("bie,bij,bje->be", coefficients, xtwx, coefficients)
+    )
+    total_weight = weights.sum(axis=1, keepdims=True)
+    ss_total = ywy - (weights @ trial_rates) ** 2 / total_weight
+    with np.errstate(divide="ignore", invalid="ignore"):
+        r_squared = 1 - ss_residual / ss_total
+
+    return coefficients, r_squared
+
+
+def _wrap_angle(angles):
+    return (angles + np.pi) % (2 * np.pi) - np.pi
+
+
+def fit_cosine_tuning(
+    trial_rates,
+    trial_angles,
+    num_bootstrap_resamples=NUM_BOOTSTRAP_RESAMPLES,
+    confidence_level=CONFIDENCE_LEVEL,
+    seed=0,
+    resamples_per_batch=250,
+):
+    """
+    Fit `rate = baseline + depth * cos(angle - preferred_direction)` for every electrode
+    at once, with one least-squares solve over the (trials x electrodes) matrix of trial
+    firing rates.
+
+    Confidence intervals come from bootstrap resamples of trials. Each resample is a row
+    of trial weights, and all resamples in a batch are solved together as a stack of
+    3x3 normal equations, so there is no Python loop over electrodes or resamples.
+
+    Returns a dict with per-electrode arrays `baseline`, `preferred_direction`
+    (radians), `modulation_depth` (Hz) and `r_squared`, and the matching `*_ci` arrays
+    of shape (2 x electrodes) holding the lower and upper confidence bounds. The
+    preferred direction bounds are expressed as angles around the point estimate, so
+    the lower bound may be below -pi or the upper bound above pi.
+    """
+    trial_rates = np.asarray(trial_rates, dtype=np.float64)
+    trial_angles = np.asarray(trial_angles, dtype=np.float64)
+    design_matrix = get_design_matrix(trial_angles)
+    num_trials = len(trial_angles)
+
+    coefficients, r_squared = _fit_weighted(
+        design_matrix, trial_rates, np.ones((1, num_trials))
+    )
+    baseline, preferred_direction, modulation_depth = _get_tuning_parameters(
+        coefficients[0]
+    )
+    tuning = {
+        "baseline": baseline,
+        "preferred_direction": preferred_direction,
+        "modulation_depth": modulation_depth,
+        "r_squared": r_squared[0],
+    }
+
+    if num_bootstrap_resamples == 0:
+        return tuning
+
+    rng = np.random.default_rng(seed)
+    bootstrap_parameters = {name: [] for name in tuning}
+    for batch_start in range(0, num_bootstrap_resamples, resamples_per_batch):
+        num_resamples = min(resamples_per_batch, num_bootstrap_resamples - batch_start)
+        weights = _get_bootstrap_counts(rng, num_resamples, num_trials)
+        coefficients, r_squared = _fit_weighted(design_matrix, trial_rates, weights)
+        baseline, preferred_direction, modulation_depth = _get_tuning_parameters(
+            coefficients
+        )
+        bootstrap_parameters["baseline"].append(baseline)
+        bootstrap_parameters["preferred_direction"].append(preferred_direction)
+        bootstrap_parameters["modulation_depth"].append(modulation_depth)
+        bootstrap_parameters["r_squared"].append(r_squared)
+
+    percentiles = 100 * np.array([1 - confidence_level, 1 + confidence_level]) / 2
+    for name, resampled in bootstrap_parameters.items():
+        resampled = np.concatenate(resampled, axis=0)
+        if name == "preferred_direction":
+            # Take percentiles of the angular deviation from the point estimate, so
+            # the interval doesn't break where the angle wraps around.
+            deviations = _wrap_angle(resampled - tuning[name])
+            tuning[f"{name}_ci"] = tuning[name] + np.nanpercentile(
+                deviations, percentiles, axis=0
+            )
+        else:
+            tuning[f"{name}_ci"] = np.nanpercentile(resampled, percentiles, axis=0)
+
+    return tuning
+
+
+########################################################################################
+#
+# Tuning across sessions.
+#
+########################################################################################
+
+
+def fit_session_tuning(session_filepaths=TUNING_SESSION_FILEPATHS, **kwargs):
+    """
+    Fit cosine tuning for every electrode in each session. `session_filepaths` maps a
+    day number to that session's block filepaths. Returns a dict of day to the output of
+    `fit_cosine_tuning`.
+    """
+    tuning_by_day = {}
+    for day, filepaths in session_filepaths.items():
+        trial_rates, trial_angles = get_session_tuning_trials(
+            compute.load_blocks(filepaths)
+        )
+        tuning_by_day[day] = fit_cosine_tuning(trial_rates, trial_angles, **kwargs)
+
+    return tuning_by_day
+
+
+def get_tuning_stability(tuning_by_day):
+    """
+    Compare tuning between each pair of consecutive sessions. Returns a dict keyed by
+    `(earlier_day, later_day)` with per-electrode arrays `preferred_direction_change`
+    (absolute angle, in radians) and `modulation_depth_ratio` (later / earlier), plus
+    `tuning_vector_correlation`, the correlation across electrodes of the concatenated
+    cosine and sine tuning weights.
+    """
+    days = sorted(tuning_by_day)
+    stability = {}
+    for earlier_day, later_day in zip(days[:-1], days[1:]):
+        earlier = tuning_by_day[earlier_day]
+        later = tuning_by_day[later_day]
+
+        earlier_vectors = earlier["modulation_depth"] * np.array(
+            [
+                np.cos(earlier["preferred_direction"]),
+                np.sin(earlier["preferred_direction"]),
+            ]
+        )
+        later_vectors = later["modulation_depth"] * np.array(
+            [np.cos(later["preferred_direction"]), np.sin(later["preferred_direction"])]
+        )
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            modulation_depth_ratio = (
+                later["modulation_depth"] / earlier["modulation_depth"]
+            )
+
+        stability[(earlier_day, later_day)] = {
+            "preferred_direction_change": np.abs(
+                _wrap_angle(
+                    later["preferred_direction"] - earlier["preferred_direction"]
+                )
+            ),
+            "modulation_depth_ratio": modulation_depth_ratio,
+            "tuning_vector_correlation": np.corrcoef(
+                earlier_vectors.ravel(), later_vectors.ravel()
+            )[0, 1],
+        }
+
+    return stability
@@ -1,9 +1,20 @@
 import numpy as np
-import scipy.io
-from scipy.ndimage import gaussian_filter1d
 from matplotlib.patches import Circle
 import matplotlib.pyplot as plt
 
+from bci_analysis.compute import (
+    FIRST_EVER_USAGE_FILEPATHS,
+    POST_GO_CUE_sec,
+    PRE_GO_CUE_sec,
+    get_array_label,
+    get_center_out_and_back_trajectories,
+    get_direction_idx_from_vector,
+    get_radial8_windows_by_direction,
+    get_relative_timestamps,
+    get_trial_averages,
+    load_blocks,
+)
+
 
 ########################################################################################
 #
@@ -34,30 +45,6 @@ TRAJECTORY_COLORS = [
 ]
 
 
-########################################################################################
-#
-# Helpers.
-#
-########################################################################################
-
-
-def get_direction_idx_from_vector(vector):
-    """
-    Given a 2D vector, get an integer from 0 through 7 corresponding to the 1/8th slice
-    of the unit circle it falls in. Good for identifying a radial8 target, or a position
-    near a radial8 target.
-    """
-    x, y = vector
-
-    target_angle = np.arctan2(y, x)
-    if target_angle < 0:
-        target_angle += 2 * np.pi
-
-    direction_idx = int(np.round(target_angle / (np.pi / 4))) % 8
-
-    return direction_idx
-
-
 ########################################################################################
 #
 # Main function.
@@ -70,16 +57,8 @@ def main():
 
     ## Load the blocks of data from the First-ever Usage Session.
 
-    filepaths = [
-        "./dryad_files/t15_day00039_block00_radial8_calibration_task.mat",
-        "./dryad_files/t15_day00039_block01_radial8_calibration_task.mat",
-        "./dryad_files/t15_day00039_block02_radial8_calibration_task.mat",
-        "./dryad_files/t15_day00039_block03_radial8_calibration_task.mat",
-        "./dryad_files/t15_day00039_block04_radial8_calibration_task.mat",
-        "./dryad_files/t15_day00039_block05_radial8_calibration_task.mat",
-    ]
     try:
-        data = [scipy.io.loadmat(filepath) for filepath in filepaths]
+        data = load_blocks(FIRST_EVER_USAGE_FILEPATHS)
     except FileNotFoundError:
         print(
             "ERROR: Data files not found. Follow steps in the README to download data."
@@ -93,40 +72,12 @@ def main():
     unique_target_positions = set()
 
     for block_data in data:
-        cursor_positions = block_data["cursor_position"]
-        target_positions = block_data["target_position"]
-        assist_amounts = block_data["assist_amount"].flatten()
-        trial_start_bins = block_data["trial_start_bin"].flatten()
-
-        for trial_idx, trial_start_bin in enumerate(trial_start_bins):
-            # If this trial used any assist, don't draw it. Only draw fully closed-loop
-            # trials.
-            starting_assist_amount = assist_amounts[trial_start_bin]
-            if starting_assist_amount > 0.0:
-                continue
-
-            # Each trajectory we draw will start with a movement toward an outer target.
-            trial_target = target_positions[trial_start_bin]
-            CENTER_TARGET = np.array([0.0, 0.0])
-            is_toward_center_target = np.all(trial_target == CENTER_TARGET)
-            if is_toward_center_target:
-                continue
-
-            # If the block ends during this center-out-and-back, don't draw it.
-            if trial_idx + 2 >= len(trial_start_bins):
-                continue
-
-            ## Draw the center-out-and-back trajectory.
-
-            # Get the range of bins representing the full center-out-and-back, which
-            # includes the center-out trial plus the following trial back to center.
-            trajectory_start_bin = trial_start_bin
-            trajectory_end_bin = trial_start_bins[trial_idx + 2]
-
-            trajectory = cursor_positions[trajectory_start_bin:trajectory_end_bin]
-
+        for (
+            direction_idx,
+            trial_target,
+            trajectory,
+        ) in get_center_out_and_back_trajectories(block_data):
             # Color the trajectory based on the outer target.
-            direction_idx = get_direction_idx_from_vector(trial_target)
             trajectory_color = TRAJECTORY_COLORS[direction_idx]
 
             ax.plot(trajectory[:, 0], trajectory[:, 1], color=trajectory_color)
@@ -174,69 +125,16 @@ def main():
 
     ## Trial-average the neural activity for each direction of outer target.
 
-    neural_windows_grouped_by_direction = {
-        direction_idx: [] for direction_idx in range(8)
-    }
-
-    PRE_GO_CUE_sec = 0.5
-    POST_GO_CUE_sec = 1.0
+    neural_windows_grouped_by_direction = get_radial8_windows_by_direction(data)
 
-    BIN_WIDTH_sec = 0.01
-    PRE_GO_CUE_bins = int(PRE_GO_CUE_sec / BIN_WIDTH_sec)
-    POST_GO_CUE_bins = int(POST_GO_CUE_sec / BIN_WIDTH_sec)
-
-    for block_data in data:
-        threshold_crossings = block_data["threshold_crossings"]
-        target_positions = block_data["target_position"]
-        trial_start_bins = block_data["trial_start_bin"].flatten()
-
-        # Scale threshold crossings values to represent firing rates in Hz.
-        firing_rates = threshold_crossings / BIN_WIDTH_sec
-        # Apply smoothing.
-        SMOOTHING_SIGMA = 5
-        firing_rates = gaussian_filter1d(firing_rates, sigma=SMOOTHING_SIGMA, axis=0)
-
-        total_bins = len(firing_rates)
-
-        for trial_start_bin in trial_start_bins:
-            trial_target = target_positions[trial_start_bin]
-
-            # Skip trials toward the center target (the user can anticipate the target).
-            CENTER_TARGET = np.array([0.0, 0.0])
-            is_toward_center_target = np.all(trial_target == CENTER_TARGET)
-            if is_toward_center_target:
-                continue
-
-            neural_window_start_bin = trial_start_bin - PRE_GO_CUE_bins
-            neural_window_end_bin = trial_start_bin + POST_GO_CUE_bins
-
-            # Skip windows at the start or end of the block which go outside the block.
-            if neural_window_start_bin < 0 or neural_window_end_bin > total_bins:
-                continue
-
-            neural_window = firing_rates[neural_window_start_bin:neural_window_end_bin]
-
-            direction_idx = get_direction_idx_from_vector(trial_target)
-            neural_windows_grouped_by_direction[direction_idx].append(neural_window)
-
-    # Average across trials for each direction.
-    trial_averaged_by_direction = {
-        direction_idx: np.mean(neural_windows, axis=0)
-        for direction_idx, neural_windows in neural_windows_grouped_by_direction.items()
-    }
-    # Get the standard error of the mean for each direction.
-    sem_by_direction = {
-        direction_idx: np.std(neural_windows, axis=0) / np.sqrt(len(neural_windows))
-        for direction_idx, neural_windows in neural_windows_grouped_by_direction.items()
-    }
+    trial_averaged_by_direction, sem_by_direction = get_trial_averages(
+        neural_windows_grouped_by_direction
+    )
 
     ## Plot the trial-averaged firing rates for a select few electrodes.
 
     SELECTED_ELECTRODES = [227, 236, 122]
-    num_bins_in_window = int((PRE_GO_CUE_sec + POST_GO_CUE_sec) / BIN_WIDTH_sec)
-    relative_timestamps = np.linspace(
-        -PRE_GO_CUE_sec, POST_GO_CUE_sec, num_bins_in_window
-    )
+    relative_timestamps = get_relative_timestamps()
 
     for electrode_idx in SELECTED_ELECTRODES:
         fig, ax = plt.subplots()
@@ -294,7 +192,7 @@ def main():
         ax.spines["left"].set_position(("data", -PRE_GO_CUE_sec - 0.1))
         ax.spines["left"].set_linewidth(3)
 
-        array_label = data[0]["array_label_by_electrode"][electrode_idx].strip()
+        array_label = get_array_label(data[0], electrode_idx)
         fig.suptitle(f"electrode {electrode_idx}\n(array {array_label})", fontsize=20)
 
         plt.tight_layout()
@@ -1,7 +1,12 @@
 import numpy as np
-import scipy.io
 import matplotlib.pyplot as plt
 
+from bci_analysis.compute import (
+    GRID_EVALUATION_FILEPATHS,
+    get_grid_block_results,
+    load_blocks,
+)
+
 
 ########################################################################################
 #
@@ -16,19 +21,8 @@ def main():
     ## Load the Grid Evaluation Task blocks of data from the last Evaluation Session.
     ## This session used the improved decoder and denser grid.
 
-    filepaths = [
-        "./dryad_files/t15_day00468_block03_grid_evaluation_task.mat",
-        "./dryad_files/t15_day00468_block04_grid_evaluation_task.mat",
-        "./dryad_files/t15_day00468_block05_grid_evaluation_task.mat",
-        "./dryad_files/t15_day00468_block09_grid_evaluation_task.mat",
-        "./dryad_files/t15_day00468_block10_grid_evaluation_task.mat",
-        "./dryad_files/t15_day00468_block11_grid_evaluation_task.mat",
-        "./dryad_files/t15_day00468_block15_grid_evaluation_task.mat",
-        "./dryad_files/t15_day00468_block16_grid_evaluation_task.mat",
-        "./dryad_files/t15_day00468_block17_grid_evaluation_task.mat",
-    ]
     try:
-        data = [scipy.io.loadmat(filepath) for filepath in filepaths]
+        data = load_blocks(GRID_EVALUATION_FILEPATHS)
     except FileNotFoundError:
         print(
             "ERROR: Data files not found. Follow steps in the README to download data."
@@ -42,47 +36,12 @@ def main():
     bitrates = []
 
     for ax_idx, (block_ax, block_data) in enumerate(zip(axs, data)):
-        timestamps = block_data["timestamp_sec"].flatten()
-        cursor_positions = block_data["cursor_position"]
-        target_positions = block_data["target_position"]
-        trial_start_bins = block_data["trial_start_bin"].flatten()
-        grid_num_rows = block_data["grid_num_rows"].item()
-        grid_total_height = block_data["grid_total_height"].item()
-
-        # Get which bins the cursor was on the cued target.
-        row_height = column_width = grid_total_height / grid_num_rows
-        target_distances = np.abs(target_positions - cursor_positions)
-        is_within_x = target_distances[:, 0] < (column_width / 2)
-        is_within_y = target_distances[:, 1] < (row_height / 2)
-        is_on_cued_target = is_within_x & is_within_y
-
-        # Get which trial-ending clicks were on the cued target and which were not.
-        trial_results = []
-        trial_ending_click_bins = trial_start_bins - 1
-        trial_ending_click_bins = trial_ending_click_bins[1:]
-        trial_ending_click_timestamps = np.array(
-            [timestamps[bin_idx] for bin_idx in trial_ending_click_bins]
-        )
-        for trial_ending_click_bin in trial_ending_click_bins:
-            is_success = is_on_cued_target[trial_ending_click_bin]
-            trial_results.append(is_success)
-        trial_results = np.array(trial_results)
-
-        # Get trial lengths.
-        trial_start_timestamps = np.array(
-            [timestamps[bin_idx] for bin_idx in trial_start_bins]
-        )
-        trial_lengths = np.diff(trial_start_timestamps)
-
-        # Calculate bitrate, for plotting later.
-        total_length = timestamps[-1] - timestamps[0]
-        num_success = sum(trial_results)
-        num_fail = len(trial_results) - num_success
-        net_target_selections = num_success - num_fail
-        total_target_options = 14 * 14
-        bits_per_selection = np.log2(total_target_options - 1)
-        bitrate = (net_target_selections * bits_per_selection) / total_length
-        bitrates.append(bitrate)
+        block_results = get_grid_block_results(block_data)
+        trial_ending_click_timestamps = block_results["trial_ending_click_timestamps"]
+        trial_results = block_results["trial_results"]
+        trial_lengths = block_results["trial_lengths"]
+
+        bitrates.append(block_results["bitrate"])
 
         ## Plot this block's trial results on the corresponding subplot.
 
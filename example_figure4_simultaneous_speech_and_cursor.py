@@ -1,8 +1,20 @@
 import numpy as np
-import scipy.io
-from scipy.ndimage import gaussian_filter1d
 import matplotlib.pyplot as plt
 
+from bci_analysis.compute import (
+    POST_GO_CUE_sec,
+    PRE_GO_CUE_sec,
+    PROMPTS,
+    SIMULTANEOUS_SPEECH_AND_CURSOR_FILEPATHS,
+    get_ABA_blocks,
+    get_acquisition_times_by_condition,
+    get_array_label,
+    get_relative_timestamps,
+    get_simultaneous_windows,
+    get_trial_averages,
+    load_blocks,
+)
+
 
 ########################################################################################
 #
@@ -31,7 +43,6 @@ TRAJECTORY_COLORS = [
     (0.55568627, 0.417647059, 0.735294119),
     (0.92352941, 0.36274510, 0.69215686),
 ]
-PROMPTS = ["bah", "though", "day", "kite", "choice", "veto", "were"]
 PROMPT_COLORS = {
     "bah": (0.71, 0.84, 0.44),
     "though": (0.75, 0.5, 0.75),
@@ -43,30 +54,6 @@ PROMPT_COLORS = {
 }
 
 
-########################################################################################
-#
-# Helpers.
-#
-########################################################################################
-
-
-def get_direction_idx_from_vector(vector):
-    """
-    Given a 2D vector, get an integer from 0 through 7 corresponding to the 1/8th slice
-    of the unit circle it falls in. Good for identifying a radial8 target, or a position
-    near a radial8 target.
-    """
-    x, y = vector
-
-    target_angle = np.arctan2(y, x)
-    if target_angle < 0:
-        target_angle += 2 * np.pi
-
-    direction_idx = int(np.round(target_angle / (np.pi / 4))) % 8
-
-    return direction_idx
-
-
 ########################################################################################
 #
 # Main function.
@@ -80,31 +67,8 @@ def main():
     ## Load the Simultaneous Speech and Cursor Task blocks of data from the Simultaneous
     ## Speech and Cursor Session.
 
-    filepaths = [
-        "./dryad_files/t15_day00202_block02_simultaneous_speech_and_cursor_task.mat",
-        "./dryad_files/t15_day00202_block03_simultaneous_speech_and_cursor_task.mat",
-        "./dryad_files/t15_day00202_block04_simultaneous_speech_and_cursor_task.mat",
-        "./dryad_files/t15_day00202_block05_simultaneous_speech_and_cursor_task.mat",
-        "./dryad_files/t15_day00202_block06_simultaneous_speech_and_cursor_task.mat",
-        "./dryad_files/t15_day00202_block07_simultaneous_speech_and_cursor_task.mat",
-        "./dryad_files/t15_day00202_block10_simultaneous_speech_and_cursor_task.mat",
-        "./dryad_files/t15_day00202_block11_simultaneous_speech_and_cursor_task.mat",
-        "./dryad_files/t15_day00202_block12_simultaneous_speech_and_cursor_task.mat",
-        "./dryad_files/t15_day00202_block13_simultaneous_speech_and_cursor_task.mat",
-        "./dryad_files/t15_day00202_block14_simultaneous_speech_and_cursor_task.mat",
-        "./dryad_files/t15_day00202_block15_simultaneous_speech_and_cursor_task.mat",
-        "./dryad_files/t15_day00202_block16_simultaneous_speech_and_cursor_task.mat",
-        "./dryad_files/t15_day00202_block17_simultaneous_speech_and_cursor_task.mat",
-        "./dryad_files/t15_day00202_block18_simultaneous_speech_and_cursor_task.mat",
-        "./dryad_files/t15_day00202_block21_simultaneous_speech_and_cursor_task.mat",
-        "./dryad_files/t15_day00202_block22_simultaneous_speech_and_cursor_task.mat",
-        "./dryad_files/t15_day00202_block23_simultaneous_speech_and_cursor_task.mat",
-        "./dryad_files/t15_day00202_block24_simultaneous_speech_and_cursor_task.mat",
-        "./dryad_files/t15_day00202_block25_simultaneous_speech_and_cursor_task.mat",
-        "./dryad_files/t15_day00202_block26_simultaneous_speech_and_cursor_task.mat",
-    ]
     try:
-        data = [scipy.io.loadmat(filepath) for filepath in filepaths]
+        data = load_blocks(SIMULTANEOUS_SPEECH_AND_CURSOR_FILEPATHS)
     except FileNotFoundError:
         print(
             "ERROR: Data files not found. Follow steps in the README to download data."
@@ -112,62 +76,21 @@ def main():
 
     ## Calculate target acquisition times and group them by task condition.
 
-    verbal_blocks_beep_trials = []
-    verbal_blocks_nobeep_trials = []
-    control_blocks_beep_trials = []
-    control_blocks_nobeep_trials = []
-
-    # The 21 simul blocks (A = verbal, B = control) were collected in 3 sets as follows:
-    # 1. A A B A A B
-    # 2. A A B A A B A A B
-    # 3. A A B A A B
-    # with a break and some cursor calibration before each set.
-
-    # To allow for a fair comparison between verbal and control blocks, we should have
-    # an A B A structure from each set. Achieve this by excluding the first A in each
-    # set and the last A B in each set.
-    ABA_data = np.concatenate([data[1:4], data[7:13], data[16:19]])
-
-    for block_data in ABA_data:
-        timestamps = block_data["timestamp_sec"].flatten()
-        cursor_go_cue_bins = block_data["cursor_go_cue_bin"].flatten()
-        speech_go_cue_bins = block_data["speech_go_cue_bin"].flatten()
-        trial_end_bins = block_data["trial_end_bin"].flatten()
-        is_control_block = block_data["is_control_block"].item()
-        is_verbal_block = not is_control_block
-
-        for trial_idx in range(len(cursor_go_cue_bins)):
-            cursor_go_cue_bin = cursor_go_cue_bins[trial_idx]
-            speech_go_cue_bin = speech_go_cue_bins[trial_idx]
-            trial_end_bin = trial_end_bins[trial_idx]
-
-            # If there was no beep in this trial, the speech go cue bin is -1.
-            is_beep_trial = speech_go_cue_bin != -1
-
-            trial_end_timestamp = timestamps[trial_end_bin]
-            cursor_go_cue_timestamp = timestamps[cursor_go_cue_bin]
-            target_acquisition_time = trial_end_timestamp - cursor_go_cue_timestamp
-
-            if is_verbal_block:
-                if is_beep_trial:
-                    verbal_blocks_beep_trials.append(target_acquisition_time)
-                else:
-                    verbal_blocks_nobeep_trials.append(target_acquisition_time)
-            else:
-                if is_beep_trial:
-                    control_blocks_beep_trials.append(target_acquisition_time)
-                else:
-                    control_blocks_nobeep_trials.append(target_acquisition_time)
+    # Only use an A B A structure (A = verbal, B = control) from each set of blocks,
+    # for a fair comparison between verbal and control blocks.
+    ABA_data = get_ABA_blocks(data)
+
+    acquisition_times_by_condition = get_acquisition_times_by_condition(ABA_data)
 
     ## Plot a boxplot of trial lengths for each condition.
 
     fig, ax = plt.subplots()
 
     condition_trial_times = [
-        control_blocks_nobeep_trials,
-        control_blocks_beep_trials,
-        verbal_blocks_nobeep_trials,
-        verbal_blocks_beep_trials,
+        acquisition_times_by_condition["control_nobeep"],
+        acquisition_times_by_condition["control_beep"],
+        acquisition_times_by_condition["verbal_nobeep"],
+        acquisition_times_by_condition["verbal_beep"],
     ]
     condition_x_positions = [0.5, 1.5, 3.0, 4.0]
     condition_trial_types = [
@@ -247,150 +170,31 @@ def main():
 
     ## Trial-average the neural activity, aligned to different stages of the trial.
 
-    presentation_windows_grouped_by_direction = {
-        direction_idx: [] for direction_idx in range(8)
-    }
-    cursor_go_cue_windows_grouped_by_direction = {
-        direction_idx: [] for direction_idx in range(8)
-    }
-    speech_go_cue_windows_grouped_by_prompt = {prompt: [] for prompt in PROMPTS}
-
-    PRE_GO_CUE_sec = 0.5
-    POST_GO_CUE_sec = 1.0
-
-    BIN_WIDTH_sec = 0.01
-    PRE_GO_CUE_bins = int(PRE_GO_CUE_sec / BIN_WIDTH_sec)
-    POST_GO_CUE_bins = int(POST_GO_CUE_sec / BIN_WIDTH_sec)
-
-    for block_data in data:
-        threshold_crossings = block_data["threshold_crossings"]
-        target_positions = block_data["target_position"]
-        target_presentation_bins = block_data["target_presentation_bin"].flatten()
-        cursor_go_cue_bins = block_data["cursor_go_cue_bin"].flatten()
-        speech_go_cue_bins = block_data["speech_go_cue_bin"].flatten()
-        speech_prompts = [s.item() for s in block_data["speech_prompt"].flatten()]
-        is_control_block = block_data["is_control_block"].item()
-        is_verbal_block = not is_control_block
-
-        # Scale threshold crossings values to represent firing rates in Hz.
-        firing_rates = threshold_crossings / BIN_WIDTH_sec
-        # Apply smoothing.
-        SMOOTHING_SIGMA = 5
-        firing_rates = gaussian_filter1d(firing_rates, sigma=SMOOTHING_SIGMA, axis=0)
-
-        total_bins = len(firing_rates)
-
-        ## Windows aligned to target presentation and to cursor go cue.
-
-        for trial_idx in range(len(target_presentation_bins)):
-            target_presentation_bin = target_presentation_bins[trial_idx]
-            cursor_go_cue_bin = cursor_go_cue_bins[trial_idx]
-            speech_go_cue_bin = speech_go_cue_bins[trial_idx]
-
-            # Skip trials with a beep.
-            if speech_go_cue_bin != -1:
-                continue
-
-            trial_target = target_positions[target_presentation_bin]
-
-            # Skip trials toward the center target (the user can anticipate the target).
-            CENTER_TARGET = np.array([0.0, 0.0])
-            is_toward_center_target = np.all(trial_target == CENTER_TARGET)
-            if is_toward_center_target:
-                continue
-
-            direction_idx = get_direction_idx_from_vector(trial_target)
-
-            # Window aligned to target presentation.
-
-            presentation_window_start_bin = target_presentation_bin - PRE_GO_CUE_bins
-            presentation_window_end_bin = target_presentation_bin + POST_GO_CUE_bins
-
-            presentation_window = firing_rates[
-                presentation_window_start_bin:presentation_window_end_bin
-            ]
-
-            presentation_windows_grouped_by_direction[direction_idx].append(
-                presentation_window
-            )
-
-            # Window aligned to cursor go cue.
-
-            cursor_go_cue_window_start_bin = cursor_go_cue_bin - PRE_GO_CUE_bins
-            cursor_go_cue_window_end_bin = cursor_go_cue_bin + POST_GO_CUE_bins
-
-            cursor_go_cue_window = firing_rates[
-                cursor_go_cue_window_start_bin:cursor_go_cue_window_end_bin
-            ]
-
-            cursor_go_cue_windows_grouped_by_direction[direction_idx].append(
-                cursor_go_cue_window
-            )
-
-        ## Windows aligned to speech go cue.
-
-        for trial_idx in range(len(speech_go_cue_bins)):
-            speech_go_cue_bin = speech_go_cue_bins[trial_idx]
-            speech_prompt = speech_prompts[trial_idx]
-
-            # Skip trials with no beep.
-            if speech_go_cue_bin == -1:
-                continue
-
-            # Skip trials in control blocks (since control blocks don't have speech).
-            if is_control_block:
-                continue
-
-            speech_go_cue_window_start_bin = speech_go_cue_bin - PRE_GO_CUE_bins
-            speech_go_cue_window_end_bin = speech_go_cue_bin + POST_GO_CUE_bins
-
-            # Skip windows at the end of the block which go outside the block.
-            if speech_go_cue_window_end_bin > total_bins:
-                continue
-
-            speech_go_cue_window = firing_rates[
-                speech_go_cue_window_start_bin:speech_go_cue_window_end_bin
-            ]
-
-            speech_go_cue_windows_grouped_by_prompt[speech_prompt].append(
-                speech_go_cue_window
-            )
-
-    # Average across trials.
-    presentation_trial_averaged_by_direction = {
-        direction_idx: np.mean(neural_windows, axis=0)
-        for direction_idx, neural_windows in presentation_windows_grouped_by_direction.items()
-    }
-    cursor_go_cue_trial_averaged_by_direction = {
-        direction_idx: np.mean(neural_windows, axis=0)
-        for direction_idx, neural_windows in cursor_go_cue_windows_grouped_by_direction.items()
-    }
-    speech_go_cue_trial_averaged_by_prompt = {
-        prompt: np.mean(neural_windows, axis=0)
-        for prompt, neural_windows in speech_go_cue_windows_grouped_by_prompt.items()
-    }
-    # Get the standard error of the mean.
-    presentation_sem_by_direction = {
-        direction_idx: np.std(neural_windows, axis=0) / np.sqrt(len(neural_windows))
-        for direction_idx, neural_windows in presentation_windows_grouped_by_direction.items()
-    }
-    cursor_go_cue_sem_by_direction = {
-        direction_idx: np.std(neural_windows, axis=0) / np.sqrt(len(neural_windows))
-        for direction_idx, neural_windows in cursor_go_cue_windows_grouped_by_direction.items()
-    }
-    speech_go_cue_sem_by_direction = {
-        prompt: np.std(neural_windows, axis=0) / np.sqrt(len(neural_windows))
-        for prompt, neural_windows in speech_go_cue_windows_grouped_by_prompt.items()
-    }
+    (
+        presentation_windows_grouped_by_direction,
+        cursor_go_cue_windows_grouped_by_direction,
+        speech_go_cue_windows_grouped_by_prompt,
+    ) = get_simultaneous_windows(data)
+
+    # Average across trials, and get the standard error of the mean.
+    (
+        presentation_trial_averaged_by_direction,
+        presentation_sem_by_direction,
+    ) = get_trial_averages(presentation_windows_grouped_by_direction)
+    (
+        cursor_go_cue_trial_averaged_by_direction,
+        cursor_go_cue_sem_by_direction,
+    ) = get_trial_averages(cursor_go_cue_windows_grouped_by_direction)
+    (
+        speech_go_cue_trial_averaged_by_prompt,
+        speech_go_cue_sem_by_prompt,
+    ) = get_trial_averages(speech_go_cue_windows_grouped_by_prompt)
 
     ## Plot individual channels' trial-averaged firing rates aligned to different stages
     ## of the trial.
 
     SELECTED_ELECTRODES = [229, 165, 247]
-    num_bins_in_window = int((PRE_GO_CUE_sec + POST_GO_CUE_sec) / BIN_WIDTH_sec)
-    relative_timestamps = np.linspace(
-        -PRE_GO_CUE_sec, POST_GO_CUE_sec, num_bins_in_window
-    )
+    relative_timestamps = get_relative_timestamps()
 
     for electrode_idx in SELECTED_ELECTRODES:
         fig, (presentation_ax, cursor_go_cue_ax, speech_go_cue_ax) = plt.subplots(1, 3)
@@ -496,7 +300,7 @@ def main():
             trial_averaged = speech_go_cue_trial_averaged_by_prompt[prompt][
                 :, electrode_idx
             ]
-            sem = speech_go_cue_sem_by_direction[prompt][:, electrode_idx]
+            sem = speech_go_cue_sem_by_prompt[prompt][:, electrode_idx]
             color = PROMPT_COLORS[prompt]
             speech_go_cue_ax.plot(
                 relative_timestamps, trial_averaged, color=color, linewidth=2
@@ -529,7 +333,7 @@ def main():
             speech_go_cue_ax.spines["bottom"].set_visible(False)
             speech_go_cue_ax.spines["left"].set_visible(False)
 
-        array_label = data[0]["array_label_by_electrode"][electrode_idx].strip()
+        array_label = get_array_label(data[0], electrode_idx)
         fig.suptitle(f"electrode {electrode_idx}\n(array {array_label})", fontsize=20)
         fig.set_figwidth(13)
         fig.set_figheight(5)